@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+
+"""
+author@kathrynegan
+
+Copyright (c) 2015-2017 Fred Hutchinson Cancer Research Center
+
+Licensed under the Apache License, Version 2.0: http://www.apache.org/licenses/LICENSE-2.0
+
+Equivalence check and microbenchmark for vectorizer.get_text. Compares the
+original character by character loop against the current function on a
+generated corpus mixing ascii, utf-8 and latin-1 bytes, runs of spaces,
+tabs, newlines and whole or broken <newline> markers, as byte strings and
+as unicode. Reports from an input file can be added too. Exits with an
+error if any text differs.
+
+Usage: python benchmarks/get_text.py [input file] [max reports]
+"""
+import os
+import re
+import sys
+import csv
+import time
+import random
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from run import TEXT
+from utils.vectorizer import get_text
+
+PIECES = [
+	'EGFR', 'alk', ' ', '  ', '   ', '\t', '\n', '.', '<newline>', '<new', 'line>',
+	'<newline><newline>', u'\xe9', u'’', u'\xa0', u' \xa0 ', u'中']
+
+
+def legacy_get_text(text):
+	""" Ascii-only text as get_text used to make it, one character at a time.
+	Args:
+		text (str) : text to remove non-ascii characters from
+	Returns:
+		str : processed text
+	"""
+	ascii_only = []
+	for char in text:
+		if ord(char) >= 128:
+			char = ' '
+		ascii_only.append(char)
+	ascii_only = ''.join(ascii_only)
+	ascii_only = re.sub(r' +', ' ', ascii_only)
+	text = re.sub(r' +', ' ', ascii_only)
+	text = text.replace('<newline>', '\n')
+	return text
+
+
+def make_corpus(generator, count, length=60):
+	""" Returns texts of random pieces in the form reports are read in: byte
+	strings (utf-8 or latin-1) and unicode on python 2, unicode on python 3.
+	Args:
+		generator (random.Random) : source of randomness
+		count (int) : number of texts of each form
+		length (int) : most pieces in a text
+	Returns:
+		list of str : texts
+	"""
+	corpus = []
+	for index in range(count):
+		text = u''.join(
+			generator.choice(PIECES) for i in range(generator.randint(0, length)))
+		corpus.append(text)
+		if str is bytes:
+			corpus.append(text.encode('utf-8'))
+			corpus.append(text.encode('latin-1', 'replace'))
+	return corpus
+
+
+def load_reports(file, limit):
+	""" Returns the raw text of reports in a tab delimited input file. """
+	csv.field_size_limit(sys.maxsize)
+	reports = []
+	with open(file, 'r') as fin:
+		reader = csv.reader(fin, delimiter='\t')
+		column = next(reader).index(TEXT)
+		for row in reader:
+			if len(reports) >= limit:
+				break
+			reports.append(row[column])
+	return reports
+
+
+def main():
+	corpus = make_corpus(random.Random(0), 5000)
+	if len(sys.argv) > 1:
+		limit = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+		corpus += load_reports(sys.argv[1], limit)
+	timings = {}
+	for function in legacy_get_text, get_text:
+		start = time.time()
+		results = [function(text) for text in corpus]
+		timings[function.__name__] = (time.time() - start, results)
+	legacy_time, legacy_results = timings['legacy_get_text']
+	current_time, current_results = timings['get_text']
+	mismatches = [
+		index for index, (legacy, current) in
+		enumerate(zip(legacy_results, current_results)) if legacy != current]
+	characters = max(sum(len(text) for text in corpus), 1)
+	for name, seconds in ('legacy', legacy_time), ('current', current_time):
+		sys.stdout.write('{}\t{:.1f} ns/char\n'.format(name, seconds * 1e9 / characters))
+	sys.stdout.write('speedup\t{:.1f}x over {} texts, {} mismatches\n'.format(
+		legacy_time / max(current_time, 1e-9), len(corpus), len(mismatches)))
+	if mismatches:
+		for index in mismatches[:5]:
+			sys.stderr.write('MISMATCH: {!r}\n'.format(corpus[index]))
+		sys.exit(1)
+
+
+if __name__ == "__main__":
+	main()
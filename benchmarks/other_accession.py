@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+
+"""
+author@kathrynegan
+
+Copyright (c) 2015-2017 Fred Hutchinson Cancer Research Center
+
+Licensed under the Apache License, Version 2.0: http://www.apache.org/licenses/LICENSE-2.0
+
+Regression corpus and microbenchmark for Vectorizer._other_accession.
+Compares the text produced by the original one re.sub per match against
+the current implementation on a generated corpus of tricky accession
+numbers: parenthesized, spaced, repeated, adjacent, prefixes of one
+another, ending where a replacement could begin, and cumulative reports
+citing enough specimens to take the fused single pass. Reports from an
+input file can be added too. Exits with an error if any text differs.
+
+Usage: python benchmarks/other_accession.py [input file] [max reports]
+"""
+import os
+import re
+import sys
+import csv
+import time
+import random
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from run import TEXT, ACC
+from utils.vectorizer import Vectorizer, FUSE_MIN, _Document
+
+FILLER = 'see prior specimen and the tumor cells on block of'.split()
+SEPARATORS = [' ', '  ', ', ', ' (', ') ', '; ', '\n', '.', '-', '']
+
+
+def legacy_other_accession(vectorizer, text, accession):
+	""" Text after one escaped re.sub per matched accession number, as
+	_other_accession used to do.
+	Args:
+		vectorizer (Vectorizer) : vectorizing object
+		text (str) : report text
+		accession (str) : normalized accession number of the report
+	Returns:
+		str : substituted text
+	"""
+	for match in vectorizer.accession_pattern.finditer(text):
+		found = re.sub(r'[()\- ]', '', match.group(1))
+		if found == accession:
+			subin = ' THIS_ACC_NUM '
+		else:
+			subin = ' OTHER_ACC_NUM '
+		subout = match.group(1)
+		subout = re.sub(r'\(', '\\(', subout)
+		subout = re.sub(r'\)', '\\)', subout)
+		text = re.sub(subout, subin, text)
+	return text
+
+
+def current_other_accession(vectorizer, text, accession):
+	""" Text after the current _other_accession.
+	Args:
+		vectorizer (Vectorizer) : vectorizing object
+		text (str) : report text
+		accession (str) : normalized accession number of the report
+	Returns:
+		str : substituted text
+	"""
+	doc = _Document(text, accession, None)
+	vectorizer._other_accession(doc)
+	return doc.text
+
+
+def make_accession(generator):
+	""" Returns a random accession number in one of its written forms. """
+	letters = ''.join(generator.choice('SPMU') for i in range(generator.randint(1, 2)))
+	first = str(generator.randint(0, 10 ** generator.randint(2, 4) - 1)).zfill(2)
+	second = str(generator.randint(0, 10 ** generator.randint(2, 8) - 1)).zfill(2)
+	accession = letters + generator.choice(['', '-', ' ']) + first + \
+		generator.choice(['-', ' ', ' - ', '--']) + second
+	if generator.random() < 0.2:
+		accession = '(' + accession + ')'
+	return accession
+
+
+def related(generator, accession):
+	""" Returns a variant of accession that overlaps it: a prefix, an
+	extension, or one starting with the end of a replacement label. """
+	choice = generator.randint(0, 3)
+	if choice == 0 and len(accession) > 6:
+		return accession[:-1]
+	if choice == 1:
+		return accession + str(generator.randint(0, 9))
+	if choice == 2:
+		return 'M ' + str(generator.randint(10, 99)) + '-' + str(generator.randint(10, 99))
+	return 'UM' + accession.lstrip('(')[2:]
+
+
+def make_corpus(generator, count):
+	""" Returns (text, accession) pairs covering the tricky cases.
+	Args:
+		generator (random.Random) : source of randomness
+		count (int) : number of reports
+	Returns:
+		list of (str, str) : report text and normalized accession number
+	"""
+	corpus = []
+	for index in range(count):
+		cited = [make_accession(generator) for i in range(generator.choice(
+			[1, 2, 5, FUSE_MIN, FUSE_MIN * 2]))]
+		if generator.random() < 0.5:
+			cited += [related(generator, generator.choice(cited)) for i in range(3)]
+		parts = []
+		for i in range(generator.randint(len(cited), len(cited) * 3)):
+			if generator.random() < 0.5:
+				parts.append(generator.choice(cited))
+			else:
+				parts.append(generator.choice(FILLER))
+			parts.append(generator.choice(SEPARATORS))
+		own = re.sub(r'[()\- ]', '', generator.choice(cited))
+		corpus.append((' '.join(parts), own))
+	return corpus
+
+
+def load_reports(file, limit):
+	""" Returns (text, accession) pairs from a tab delimited input file. """
+	vectorizer = Vectorizer()
+	csv.field_size_limit(sys.maxsize)
+	reports = []
+	with open(file, 'r') as fin:
+		reader = csv.reader(fin, delimiter='\t')
+		headers = next(reader)
+		text, accession = headers.index(TEXT), headers.index(ACC)
+		for row in reader:
+			if len(reports) >= limit:
+				break
+			reports.append((
+				vectorizer._get_text(row[text]), re.sub(r'[\- ]', '', row[accession])))
+	return reports
+
+
+def main():
+	corpus = make_corpus(random.Random(0), 5000)
+	if len(sys.argv) > 1:
+		limit = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+		corpus += load_reports(sys.argv[1], limit)
+	vectorizer = Vectorizer()
+	timings = {}
+	for function in legacy_other_accession, current_other_accession:
+		start = time.time()
+		results = [function(vectorizer, text, accession) for text, accession in corpus]
+		timings[function.__name__] = (time.time() - start, results)
+	legacy_time, legacy_results = timings['legacy_other_accession']
+	current_time, current_results = timings['current_other_accession']
+	mismatches = [
+		index for index, (legacy, current) in
+		enumerate(zip(legacy_results, current_results)) if legacy != current]
+	for name, seconds in ('legacy', legacy_time), ('current', current_time):
+		sys.stdout.write('{}\t{:.1f} us/report\n'.format(
+			name, seconds * 1e6 / max(len(corpus), 1)))
+	sys.stdout.write('speedup\t{:.1f}x over {} reports, {} mismatches\n'.format(
+		legacy_time / max(current_time, 1e-9), len(corpus), len(mismatches)))
+	if mismatches:
+		for index in mismatches[:5]:
+			sys.stderr.write('MISMATCH: {!r}\n'.format(corpus[index]))
+		sys.exit(1)
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+
+"""
+author@kathrynegan
+
+Copyright (c) 2015-2017 Fred Hutchinson Cancer Research Center
+
+Licensed under the Apache License, Version 2.0: http://www.apache.org/licenses/LICENSE-2.0
+
+Microbenchmark for Vectorizer._positive_test. Compares the per-report
+compile of truncated "TEST +" patterns against the fused per-marker
+patterns built once in Vectorizer.__init__.
+
+Usage: python benchmarks/positive_test.py <input file> [max reports]
+"""
+import os
+import re
+import sys
+import csv
+import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from run import TEXT, MARKERS
+from utils.vectorizer import Vectorizer
+
+
+def legacy_positive_test(vectorizer, text, marker):
+	""" Per-report compile of truncated patterns, as _positive_test used to do.
+	Args:
+		vectorizer (Vectorizer) : vectorizing object
+		text (str) : ascii-only report text
+		marker (str) : marker to look for
+	Returns:
+		bool : True if a positive test of marker is found in text
+	"""
+	for pattern, test in vectorizer.test_patterns:
+		if test != marker:
+			continue
+		trunc_pattern = re.compile(pattern.pattern[:-5] + r'[\s]*[\+]')
+		if trunc_pattern.search(text):
+			return True
+	return False
+
+
+def fused_positive_test(vectorizer, text, marker):
+	""" Single search with the precompiled per-marker pattern.
+	Args:
+		vectorizer (Vectorizer) : vectorizing object
+		text (str) : ascii-only report text
+		marker (str) : marker to look for
+	Returns:
+		bool : True if a positive test of marker is found in text
+	"""
+	return bool(vectorizer.positive_patterns[marker].search(text))
+
+
+def load_texts(file, limit):
+	""" Returns ascii-only report texts from a tab delimited input file.
+	Args:
+		file (str) : path to input file
+		limit (int) : maximum number of reports to read
+	Returns:
+		list of str : report texts
+	"""
+	vectorizer = Vectorizer()
+	csv.field_size_limit(sys.maxsize)
+	texts = []
+	with open(file, 'r') as fin:
+		reader = csv.reader(fin, delimiter='\t')
+		column = next(reader).index(TEXT)
+		for row in reader:
+			if len(texts) >= limit:
+				break
+			texts.append(vectorizer._get_text(row[column]))
+	return texts
+
+
+def main():
+	try:
+		file = sys.argv[1]
+	except IndexError:
+		raise IndexError('Provide path to input file as first argument.')
+	limit = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+	vectorizer = Vectorizer()
+	texts = load_texts(file, limit)
+	timings = {}
+	for function in legacy_positive_test, fused_positive_test:
+		start = time.time()
+		results = [
+			function(vectorizer, text, marker) for text in texts for marker in MARKERS]
+		timings[function.__name__] = (time.time() - start, results)
+	legacy_time, legacy_results = timings['legacy_positive_test']
+	fused_time, fused_results = timings['fused_positive_test']
+	if legacy_results != fused_results:
+		sys.stderr.write('WARNING: fused and legacy results differ.\n')
+	for name, seconds in ('legacy', legacy_time), ('fused', fused_time):
+		sys.stdout.write('{}\t{:.1f} us/report\n'.format(
+			name, seconds * 1e6 / max(len(texts), 1)))
+	sys.stdout.write('speedup\t{:.1f}x over {} reports\n'.format(
+		legacy_time / max(fused_time, 1e-9), len(texts)))
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+
+"""
+author@kathrynegan
+
+Copyright (c) 2015-2017 Fred Hutchinson Cancer Research Center
+
+Licensed under the Apache License, Version 2.0: http://www.apache.org/licenses/LICENSE-2.0
+
+Equivalence check and microbenchmark for readers.SubsetReader. Writes an
+input file of long reports, some with quoted text spanning lines, and reads
+a 200 record and a 50 patient subset of it both by parsing every row with
+csv and then filtering, as run.py used to, and with SubsetReader. Exits with
+an error if the rows read differ.
+
+Usage: python benchmarks/subsets.py [num rows] [report length]
+"""
+import os
+import sys
+import csv
+import time
+import random
+import shutil
+import tempfile
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from run import TEXT, ACC, PAT, TUMOR, REC, FIELD_LIMIT, plan_columns
+from utils.readers import Subsets, SubsetReader
+from benchmarks.synthetic import HEADERS, FILLER
+
+QUOTED = 0.01  # share of reports written quoted with a line break inside
+
+
+def write_input(file, count, length, generator):
+	""" Writes count rows with reports of about length characters.
+	Returns:
+		list of (str, str) : patient ID and record ID of each row
+	"""
+	ids = []
+	with open(file, 'w') as fout:
+		fout.write('\t'.join(HEADERS) + '\n')
+		for index in range(count):
+			patient = 'P{}'.format(generator.randint(0, count // 4))
+			record = 'R{}'.format(index)
+			words = length // 6
+			text = ' '.join(generator.choice(FILLER) for i in range(words))
+			if generator.random() < QUOTED:
+				text = '"{}\n""{}"""'.format(text, generator.choice(FILLER))
+			fields = {
+				REC: record, PAT: patient, TUMOR: str(generator.randint(1, 3)),
+				ACC: 'S{}'.format(index), TEXT: text, 'site': 'lung'}
+			fout.write('\t'.join(fields[header] for header in HEADERS) + '\n')
+			ids.append((patient, record))
+	return ids
+
+
+def legacy_read(file, subsets):
+	""" Rows of file in subsets, parsing every row before filtering. """
+	with open(file, 'r') as fin:
+		reader = csv.reader(fin, delimiter='\t')
+		columns = plan_columns(next(reader))
+		return [
+			row for row in reader if not subsets.excludes(
+				row[columns.patient], row[columns.record], row[columns.tumor])]
+
+
+def current_read(file, subsets):
+	""" Rows of file in subsets, read with SubsetReader. """
+	with open(file, 'r') as fin:
+		reader = SubsetReader(fin)
+		headers = next(reader)
+		columns = plan_columns(headers)
+		reader.filter(
+			subsets, columns.patient, columns.record, columns.tumor, len(headers))
+		return list(reader)
+
+
+def main():
+	count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+	length = int(sys.argv[2]) if len(sys.argv) > 2 else 4000
+	generator = random.Random(0)
+	csv.field_size_limit(FIELD_LIMIT)
+	work_dir = tempfile.mkdtemp()
+	failed = False
+	try:
+		file = os.path.join(work_dir, 'input.tsv')
+		ids = write_input(file, count, length, generator)
+		patients = os.path.join(work_dir, 'random_50_patients.txt')
+		records = os.path.join(work_dir, 'random_200_records.txt')
+		with open(patients, 'w') as fout:
+			fout.write('\n'.join(generator.sample(sorted(set(p for p, r in ids)), 50)))
+		with open(records, 'w') as fout:
+			fout.write('\n'.join(r for p, r in generator.sample(ids, 200)))
+		for name, subsets in (
+				('200 records', Subsets(records=records)),
+				('50 patients', Subsets(patients=patients))):
+			timings = {}
+			for function in legacy_read, current_read:
+				start = time.time()
+				rows = function(file, subsets)
+				timings[function.__name__] = (time.time() - start, rows)
+			legacy_time, legacy_rows = timings['legacy_read']
+			current_time, current_rows = timings['current_read']
+			sys.stdout.write(
+				'{}\tlegacy {:.2f}s\tcurrent {:.2f}s\t{:.1f}x\t{} rows{}\n'.format(
+					name, legacy_time, current_time, legacy_time / max(current_time, 1e-9),
+					len(current_rows), '' if legacy_rows == current_rows else '\tMISMATCH'))
+			failed = failed or legacy_rows != current_rows
+	finally:
+		shutil.rmtree(work_dir)
+	if failed:
+		sys.exit(1)
+
+
+if __name__ == "__main__":
+	main()
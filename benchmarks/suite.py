@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+
+"""
+author@kathrynegan
+
+Copyright (c) 2015-2017 Fred Hutchinson Cancer Research Center
+
+Licensed under the Apache License, Version 2.0: http://www.apache.org/licenses/LICENSE-2.0
+
+Benchmark suite for the classification pipeline. Generates synthetic reports
+in several length buckets (see benchmarks/synthetic.py), trains stand-in
+models unless a model directory is given, and measures per-call latency
+percentiles and throughput of Vectorizer.make_vector and
+GenTestClassifier.classify, plus end-to-end throughput of run.process_records.
+
+Usage: python benchmarks/suite.py [--reports N] [--lengths 500,2000,8000]
+	[--models DIR] [--json FILE] [--baseline FILE] [--tolerance 0.2]
+With --baseline, exits with an error if the throughput of any stage and
+length drops more than the tolerance below the saved --json results.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from run import TEXT, ACC, MARKERS, process_records
+from utils.vectorizer import Vectorizer
+from utils.gentest_classifier import GenTestClassifier
+from benchmarks.synthetic import HEADERS, ReportGenerator, write_input, build_models
+
+timer = getattr(time, 'perf_counter', time.time)
+PERCENTILES = (50, 90, 99)
+
+
+def parse_args():
+	""" Parses command line arguments.
+	Returns:
+		argparse.Namespace : parsed arguments
+	"""
+	parser = argparse.ArgumentParser(description='Benchmark the pipeline.')
+	parser.add_argument(
+		'--reports', type=int, default=200,
+		help='reports generated per length bucket (default: 200)')
+	parser.add_argument(
+		'--lengths', default='500,2000,8000,32000',
+		help='comma separated report lengths in characters')
+	parser.add_argument('--seed', type=int, default=0, help='random seed')
+	parser.add_argument(
+		'--models', default=None,
+		help='model directory to use instead of training stand-in models')
+	parser.add_argument('--json', default=None, help='file to save results to')
+	parser.add_argument(
+		'--baseline', default=None, help='results saved by an earlier --json run')
+	parser.add_argument(
+		'--tolerance', type=float, default=0.2,
+		help='allowed fractional throughput drop against --baseline')
+	return parser.parse_args()
+
+
+def percentile(values, percent):
+	""" Returns the nearest-rank percentile of values.
+	Args:
+		values (list of float) : sorted values
+		percent (int) : percentile between 0 and 100
+	Returns:
+		float : value at percentile
+	"""
+	if not values:
+		return 0.0
+	rank = int(round(percent / 100.0 * len(values) + 0.5)) - 1
+	return values[min(max(rank, 0), len(values) - 1)]
+
+
+def summarize(latencies, total=None):
+	""" Returns throughput and latency statistics of timed calls.
+	Args:
+		latencies (list of float) : seconds taken by each call
+		total (float) : seconds taken by all calls, their sum if not given
+	Returns:
+		dict (str:float) : count, calls per second and latencies in ms
+	"""
+	latencies = sorted(latencies)
+	if total is None:
+		total = sum(latencies)
+	stats = {'count': len(latencies), 'per_second': len(latencies) / max(total, 1e-9)}
+	for percent in PERCENTILES:
+		stats['p{}_ms'.format(percent)] = percentile(latencies, percent) * 1000
+	stats['max_ms'] = latencies[-1] * 1000 if latencies else 0.0
+	return stats
+
+
+def bench_vectorizer(vectorizer, rows):
+	""" Times make_vector for every report and marker.
+	Args:
+		vectorizer (Vectorizer) : vectorizing object
+		rows (list of list of str) : input rows in HEADERS order
+	Returns:
+		stats (dict str:float) : see summarize
+		vectors (list of list of str) : vector of every report and marker
+	"""
+	text, accession = HEADERS.index(TEXT), HEADERS.index(ACC)
+	latencies = []
+	vectors = []
+	for row in rows:
+		for marker in MARKERS:
+			start = timer()
+			vectors.append(vectorizer.make_vector(row[text], row[accession], marker))
+			latencies.append(timer() - start)
+	return summarize(latencies), vectors
+
+
+def bench_classifier(classifier, vectors):
+	""" Times classify for every vector.
+	Args:
+		classifier (GenTestClassifier) : classifier object
+		vectors (list of list of str) : vectors of features as strings
+	Returns:
+		dict (str:float) : see summarize
+	"""
+	latencies = []
+	for vector in vectors:
+		start = timer()
+		classifier.classify(vector)
+		latencies.append(timer() - start)
+	return summarize(latencies)
+
+
+def bench_pipeline(rows, model_dir, work_dir):
+	""" Times process_records end to end over a file of rows.
+	Args:
+		rows (list of list of str) : input rows in HEADERS order
+		model_dir (str) : path to model directory
+		work_dir (str) : directory for input and output files
+	Returns:
+		dict (str:float) : count and reports per second
+	"""
+	dirs = {
+		'input': os.path.join(work_dir, 'input.tsv'),
+		'record level': os.path.join(work_dir, 'record_level_output.txt'),
+		'case level': os.path.join(work_dir, 'case_level_output.txt'),
+		'model': model_dir}
+	write_input(dirs['input'], rows)
+	start = timer()
+	process_records(dirs)
+	total = timer() - start
+	return {'count': len(rows), 'per_second': len(rows) / max(total, 1e-9)}
+
+
+def report(results):
+	""" Writes a table of results to stdout.
+	Args:
+		results (dict str:str:dict) : stage mapped to length mapped to stats
+	"""
+	columns = ['count', 'per_second'] + [
+		'p{}_ms'.format(percent) for percent in PERCENTILES] + ['max_ms']
+	sys.stdout.write('\t'.join(['stage', 'length'] + columns) + '\n')
+	for stage in sorted(results):
+		for length in sorted(results[stage], key=int):
+			stats = results[stage][length]
+			sys.stdout.write('\t'.join([stage, length] + [
+				'{:.2f}'.format(stats[column]) if column in stats else '-'
+				for column in columns]) + '\n')
+
+
+def regressions(results, baseline, tolerance):
+	""" Returns the stages and lengths whose throughput dropped too far.
+	Args:
+		results (dict str:str:dict) : stage mapped to length mapped to stats
+		baseline (dict str:str:dict) : earlier results
+		tolerance (float) : allowed fractional throughput drop
+	Returns:
+		list of str : description of each regression
+	"""
+	found = []
+	for stage, lengths in sorted(results.items()):
+		for length, stats in sorted(lengths.items()):
+			previous = baseline.get(stage, {}).get(length)
+			if previous and stats['per_second'] < previous['per_second'] * (1 - tolerance):
+				found.append('{} at {} chars: {:.2f}/s, was {:.2f}/s'.format(
+					stage, length, stats['per_second'], previous['per_second']))
+	return found
+
+
+def main():
+	args = parse_args()
+	lengths = [int(length) for length in args.lengths.split(',')]
+	generator = ReportGenerator(args.seed)
+	buckets = [(length, list(generator.rows([length] * args.reports))) for length in lengths]
+	work_dir = tempfile.mkdtemp(prefix='gentest_bench_')
+	try:
+		model_dir = args.models
+		if model_dir is None:
+			model_dir = os.path.join(work_dir, 'models')
+			sys.stderr.write('Training stand-in models...\n')
+			build_models(model_dir, [row for length, rows in buckets for row in rows[:50]])
+		vectorizer = Vectorizer()
+		classifier = GenTestClassifier(model_dir)
+		results = {'make_vector': {}, 'classify': {}, 'process_records': {}}
+		for length, rows in buckets:
+			sys.stderr.write('Benchmarking {} reports of {} chars...\n'.format(
+				len(rows), length))
+			key = str(length)
+			results['make_vector'][key], vectors = bench_vectorizer(vectorizer, rows)
+			results['classify'][key] = bench_classifier(classifier, vectors)
+			results['process_records'][key] = bench_pipeline(rows, model_dir, work_dir)
+	finally:
+		shutil.rmtree(work_dir)
+	report(results)
+	if args.json:
+		with open(args.json, 'w') as f:
+			json.dump(results, f, indent=2, sort_keys=True)
+	if args.baseline:
+		with open(args.baseline, 'r') as f:
+			found = regressions(results, json.load(f), args.tolerance)
+		for regression in found:
+			sys.stderr.write('REGRESSION: {}\n'.format(regression))
+		if found:
+			sys.exit(1)
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,320 @@
+# -*- coding: utf-8 -*-
+
+"""
+author@kathrynegan
+
+Copyright (c) 2015-2017 Fred Hutchinson Cancer Research Center
+
+Licensed under the Apache License, Version 2.0: http://www.apache.org/licenses/LICENSE-2.0
+
+synthetic.py generates stand-in pathology reports and models for benchmarks.
+Reports are assembled from strings sampled out of the section, test and
+keyword pattern JSONs, so the vectorizer's regexes fire on them as they would
+on real reports. Models are linear SVMs trained on vectors of those reports
+and saved in the models/<algorithm>/features.txt + model.pkl layout read by
+GenTestClassifier.
+
+Usage: python benchmarks/synthetic.py <output directory> [num reports]
+Writes input.tsv and a models directory to the output directory.
+"""
+import os
+import sys
+import csv
+import json
+import zlib
+import random
+import string
+import sre_parse
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from run import TEXT, ACC, PAT, TUMOR, REC, MARKERS
+from utils.vectorizer import Vectorizer
+
+PATTERN_DIR = os.path.join(
+	os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'utils', 'patterns')
+HEADERS = [REC, PAT, TUMOR, ACC, TEXT, 'site']
+MAX_EXTRA = 3  # repeats beyond the minimum for unbounded quantifiers
+PRINTABLE = string.ascii_letters + string.digits + ' .,:;-/()+'
+FILLER = (
+	'the tumor cells were examined and show no evidence of residual carcinoma '
+	'in this specimen sample block tissue adenocarcinoma lung lobe is are was '
+	'were detected not pending see comment margins negative for malignancy '
+	'with moderate differentiation received in formalin labeled').split()
+RESULTS = ['positive', 'negative', 'not detected', 'detected', '+', 'pending']
+# label codes of each algorithm, as translated by GenTestClassifier
+LABELS = {
+	'svm_reported': [4, 5],
+	'positive': [1, 2],
+	'method': [0, 1, 2, 3, 4],
+	'insufficient': [0, 3]}
+
+
+def load_patterns(file_name):
+	""" Returns the pattern strings of a pattern JSON.
+	Args:
+		file_name (str) : name of file in utils/patterns
+	Returns:
+		dict (str:list of str) : replacement mapped to its patterns
+	"""
+	with open(os.path.join(PATTERN_DIR, file_name), 'r') as f:
+		return json.load(f)
+
+
+def sample(pattern, generator):
+	""" Returns a random string matched by a regex.
+	Args:
+		pattern (str) : regex pattern
+		generator (random.Random) : source of randomness
+	Returns:
+		str : string matching pattern
+	"""
+	return _sample(sre_parse.parse(pattern), generator)
+
+
+def _sample(parsed, generator):
+	""" Returns a random string matched by a parsed regex, walking the
+	opcodes produced by sre_parse. Anchors and lookarounds match nothing.
+	Args:
+		parsed (sre_parse.SubPattern or list) : parsed regex items
+		generator (random.Random) : source of randomness
+	Returns:
+		str : string matching the items
+	"""
+	out = []
+	for op, value in parsed:
+		op = str(op).lower()
+		if op == 'literal':
+			out.append(chr(value))
+		elif op == 'not_literal':
+			out.append(_choose(generator, lambda char: ord(char) != value))
+		elif op == 'any':
+			out.append(_choose(generator, lambda char: char.isalnum() or char == ' '))
+		elif op == 'in':
+			out.append(_choose_in(value, generator))
+		elif op == 'category':
+			out.append(_choose_in([(op, value)], generator))
+		elif op == 'branch':
+			out.append(_sample(generator.choice(value[1]), generator))
+		elif op == 'subpattern':
+			out.append(_sample(value[-1], generator))
+		elif op in ('max_repeat', 'min_repeat'):
+			low, high, item = value
+			high = min(high, low + MAX_EXTRA)
+			out.extend(
+				_sample(item, generator) for i in range(generator.randint(low, high)))
+	return ''.join(out)
+
+
+def _choose(generator, accept):
+	""" Returns a random printable character accepted by a predicate. """
+	return generator.choice([char for char in PRINTABLE if accept(char)] or [' '])
+
+
+def _choose_in(items, generator):
+	""" Returns a random character from a parsed character class. """
+	negate = False
+	accepted = []
+	for op, value in items:
+		op = str(op).lower()
+		if op == 'negate':
+			negate = True
+		elif op == 'literal':
+			accepted.append(lambda char, value=value: ord(char) == value)
+		elif op == 'range':
+			accepted.append(
+				lambda char, value=value: value[0] <= ord(char) <= value[1])
+		elif op == 'category':
+			accepted.append(_category(str(value).lower()))
+	matches = lambda char: any(accept(char) for accept in accepted)
+	if negate:
+		return _choose(generator, lambda char: not matches(char))
+	return _choose(generator, matches)
+
+
+def _category(category):
+	""" Returns a predicate for an sre character category such as digit. """
+	negate = 'not_' in category
+	if 'digit' in category:
+		accept = lambda char: char.isdigit()
+	elif 'space' in category:
+		accept = lambda char: char.isspace()
+	else:
+		accept = lambda char: char.isalnum() or char == '_'
+	if negate:
+		return lambda char: not accept(char)
+	return accept
+
+
+class ReportGenerator:
+	""" Builds synthetic pathology reports of a requested length. Each report
+	is a run of sections with a heading sampled from section_patterns.json and
+	sentences of filler mixed with keywords from other_kw_patterns.json, other
+	tests from condensed_patterns.json, dates and accession numbers. Only a
+	fraction of reports mention the processed markers, as in production. """
+
+	def __init__(self, seed=0, mention_rate=0.15):
+		""" Initializes ReportGenerator instance.
+		Args:
+			seed (int) : random seed
+			mention_rate (float) : fraction of reports mentioning a marker
+		"""
+		self.generator = random.Random(seed)
+		self.mention_rate = mention_rate
+		sections = load_patterns('section_patterns.json')
+		self.headings = [
+			pattern.replace('.{,30}', '')
+			for patterns in sections.values() for pattern in patterns]
+		keywords = load_patterns('other_kw_patterns.json')
+		self.keywords = [pattern for patterns in keywords.values() for pattern in patterns]
+		tests = load_patterns('condensed_patterns.json')
+		self.markers = dict((marker, tests[marker]) for marker in MARKERS)
+		self.tests = [
+			pattern for test, patterns in tests.items() if test not in MARKERS
+			for pattern in patterns]
+
+	def report(self, length, accession):
+		""" Returns a report of about length characters.
+		Args:
+			length (int) : target number of characters
+			accession (str) : accession number of the report, also mentioned
+				in its text now and then
+		Returns:
+			str : report text with '<newline>' line breaks
+		"""
+		generator = self.generator
+		mentions = generator.random() < self.mention_rate
+		parts = []
+		size = 0
+		while size < length:
+			if not parts or generator.random() < 0.15:
+				parts.append('<newline>{}<newline>'.format(
+					sample(generator.choice(self.headings), generator)))
+				size += len(parts[-1])
+			parts.append(self.sentence(mentions, accession))
+			size += len(parts[-1]) + 1
+		return ' '.join(parts)
+
+	def sentence(self, mentions, accession):
+		""" Returns one sentence of a report.
+		Args:
+			mentions (bool) : whether markers may be mentioned
+			accession (str) : accession number of the report
+		Returns:
+			str : sentence ending in a period
+		"""
+		generator = self.generator
+		words = []
+		for i in range(generator.randint(5, 25)):
+			chance = generator.random()
+			if chance < 0.04 and mentions:
+				marker = generator.choice(MARKERS)
+				words.append(sample(generator.choice(self.markers[marker]), generator))
+				words.append(generator.choice(RESULTS))
+			elif chance < 0.08:
+				words.append(sample(generator.choice(self.tests), generator))
+			elif chance < 0.16:
+				words.append(sample(generator.choice(self.keywords), generator))
+			elif chance < 0.17:
+				words.append('{:02d}/{:02d}/{}'.format(
+					generator.randint(1, 12), generator.randint(1, 28),
+					generator.randint(2005, 2017)))
+			elif chance < 0.18:
+				words.append(generator.choice([accession, 'S{}-{}'.format(
+					generator.randint(10, 17), generator.randint(100, 99999))]))
+			else:
+				words.append(generator.choice(FILLER))
+		return ' '.join(words) + '.'
+
+	def rows(self, lengths):
+		""" Yields input rows, one report per requested length.
+		Args:
+			lengths (list of int) : target length of each report
+		Yields:
+			list of str : row in HEADERS order
+		"""
+		generator = self.generator
+		num_patients = max(len(lengths) // 3, 1)
+		for index, length in enumerate(lengths):
+			accession = 'S{}-{}'.format(
+				generator.randint(10, 17), generator.randint(100, 99999))
+			yield [
+				'R{}'.format(index), 'P{}'.format(generator.randint(0, num_patients)),
+				str(generator.randint(1, 2)), accession,
+				self.report(length, accession), 'C34']
+
+
+def write_input(file, rows):
+	""" Writes rows as a tab delimited input file with HEADERS.
+	Args:
+		file (str) : path to input file
+		rows (iterable of list of str) : rows in HEADERS order
+	"""
+	with open(file, 'w') as fout:
+		writer = csv.writer(fout, delimiter='\t', lineterminator='\n')
+		writer.writerow(HEADERS)
+		writer.writerows(rows)
+
+
+def build_models(model_dir, rows, seed=0):
+	""" Trains a stand-in linear SVM per algorithm on vectors of the given
+	rows and saves each to model_dir/<algorithm>/features.txt and model.pkl.
+	Labels are a checksum of each vector, so the models are arbitrary but
+	deterministic; they exist to exercise the classifier, not to be right.
+	Args:
+		model_dir (str) : directory to create algorithm folders in
+		rows (list of list of str) : input rows in HEADERS order
+		seed (int) : random seed
+	"""
+	from scipy.sparse import csr_matrix
+	from sklearn.svm import LinearSVC
+	try:
+		from sklearn.externals import joblib
+	except ImportError:
+		import joblib
+	vectorizer = Vectorizer()
+	vectors = []
+	for row in rows:
+		vectors.extend(vectorizer.make_vectors(
+			row[HEADERS.index(TEXT)], row[HEADERS.index(ACC)], MARKERS).values())
+	mapping = dict(
+		(feature, index) for index, feature in
+		enumerate(sorted(set(feature for vector in vectors for feature in vector))))
+	indptr = [0]
+	indices = []
+	for vector in vectors:
+		indices.extend(sorted(set(mapping[feature] for feature in vector)))
+		indptr.append(len(indices))
+	matrix = csr_matrix(
+		([1.0] * len(indices), indices, indptr), shape=(len(vectors), len(mapping)))
+	checksums = [zlib.crc32(' '.join(sorted(set(vector))).encode('utf-8')) & 0xffffffff
+		for vector in vectors]
+	for algorithm, labels in sorted(LABELS.items()):
+		# every label appears at least once so each model knows all classes
+		targets = [labels[i % len(labels)] if i < len(labels) else
+			labels[checksum % len(labels)] for i, checksum in enumerate(checksums)]
+		estimator = LinearSVC(random_state=seed).fit(matrix, targets)
+		directory = os.path.join(model_dir, algorithm)
+		if not os.path.exists(directory):
+			os.makedirs(directory)
+		with open(os.path.join(directory, 'features.txt'), 'w') as f:
+			for feature, index in sorted(mapping.items(), key=lambda item: item[1]):
+				f.write('{} {}\n'.format(feature, index))
+		joblib.dump(estimator, os.path.join(directory, 'model.pkl'))
+
+
+def main():
+	try:
+		output_dir = sys.argv[1]
+	except IndexError:
+		raise IndexError('Provide path to output directory as first argument.')
+	num_reports = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+	if not os.path.exists(output_dir):
+		os.makedirs(output_dir)
+	generator = ReportGenerator()
+	lengths = [generator.generator.choice([500, 2000, 8000]) for i in range(num_reports)]
+	rows = list(generator.rows(lengths))
+	write_input(os.path.join(output_dir, 'input.tsv'), rows)
+	build_models(os.path.join(output_dir, 'models'), rows)
+
+
+if __name__ == "__main__":
+	main()
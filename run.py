@@ -17,8 +17,19 @@ final_output.py
 import os
 import sys
 import csv
-from utils.gentest_classifier import GenTestClassifier
-from utils.vectorizer import Vectorizer
+import argparse
+import functools
+import collections
+import multiprocessing
+from utils.case_store import CaseStore, CaseHistory
+from utils.checkpoint import Checkpoint, EVERY
+from utils.gentest_classifier import GenTestClassifier, NOT_REPORTED
+from utils.profiler import Profiler
+from utils.readers import Subsets, SubsetReader
+from utils.result_cache import ResultCache, model_version
+from utils.safe_regex import BUDGET
+from utils.vectorizer import Vectorizer, get_text
+from utils.writers import FORMATS, EXTENSIONS, Quarantine, open_writer
 
 
 TEXT = 'full_path_text'  # name of pathology report field
@@ -28,22 +39,12 @@ TUMOR = 'tumor_record'
 REC = 'source_id'  # name of record ID field
 TOTAL = 20000  # total number of records (estimated)
 MARKERS = ['EGFR', 'ALK']  # markers to process
-
-# pt_file = 'random_50_patients'
-# rd_file = 'random_200_records'
-# skip_file = 'skip_patients'
-try:
-	pt_subset = set(open(pt_file + '.txt').read().strip().split())
-except NameError:
-	pt_subset = set()
-try:
-	rd_subset = set(open(rd_file + '.txt').read().strip().split())
-except NameError:
-	rd_subset = set()
-try:
-	skip_set = set(open(skip_file + '.txt').read().strip().split())
-except NameError:
-	skip_set = set()
+BATCH = 64  # rows classified together (per worker in parallel mode)
+FIELD_LIMIT = min(sys.maxsize, 2 ** 31 - 1)  # longest report text csv will read
+# tables of each output level when writing to sqlite
+TABLES = {'record level': 'record_level_output', 'case level': 'case_level_output'}
+# positions of the fields read from each row, resolved once from the headers
+Columns = collections.namedtuple('Columns', 'accession tumor record patient text')
 
 
 def run_pipeline():
@@ -51,99 +52,381 @@ def run_pipeline():
 	Pipeline for classification of EGFR and ALK test use, result, and method.
 	Writes record level and patient level results to separate files.
 	"""
-	dirs = get_dirs()
-	cases = process_records(dirs)
-	process_patients(cases, dirs['case level'])
+	args = parse_args()
+	subsets = Subsets(args.patients, args.records, args.skip)
+	dirs = get_dirs(args.input, args.output, subsets)
+	if args.state:
+		cases = CaseHistory(args.state)
+	else:
+		cases = CaseStore(args.max_cases, args.case_store)
+	profiler = Profiler() if args.profile else None
+	cache = None
+	if args.cache:
+		version = model_version(dirs['model'], dirs['patterns'])
+		cache = ResultCache(args.cache, version, args.cache_size)
+	checkpoint = None
+	progress = None
+	if args.checkpoint:
+		run = dict(
+			(name, os.path.abspath(path) if path else None) for name, path in (
+				('input', args.input), ('record level', dirs['record level']),
+				('quarantine', args.quarantine), ('state', args.state)))
+		run['output'] = args.output
+		checkpoint = Checkpoint(args.checkpoint, run, args.checkpoint_every)
+		progress = start_checkpoint(checkpoint, args.resume, cases)
+	quarantine = None
+	if args.quarantine:
+		if progress is None:
+			quarantine = Quarantine(args.quarantine)
+		else:
+			quarantine = Quarantine(
+				args.quarantine, progress['quarantine'], progress['quarantined'])
+	try:
+		cases = process_records(
+			dirs, args.workers, args.chunk_size, cases, args.native, cache, profiler,
+			args.safe, args.windowed, args.output, subsets, checkpoint, progress,
+			quarantine)
+		if isinstance(cases, CaseHistory):
+			cases.resolve(update_status)
+		process_patients(cases, dirs['case level'], args.output)
+		if checkpoint is not None:
+			checkpoint.remove()
+			checkpoint = None
+	finally:
+		cases.close()
+		if quarantine is not None:
+			quarantine.close()
+			sys.stderr.write('{} rows of differing length written to:\n{}\n'.format(
+				quarantine.count, quarantine.path))
+		if checkpoint is not None:
+			checkpoint.close()
+			sys.stderr.write(
+				'Checkpoint kept for --resume in:\n{}\n'.format(checkpoint.path))
+		if cache is not None:
+			sys.stderr.write('Result cache: {} hits, {} misses\n'.format(
+				cache.hits, cache.misses))
+			cache.close()
+		if profiler is not None:
+			profiler.write(args.profile)
+			sys.stderr.write('Profile written to:\n{}\n'.format(args.profile))
+
 
+def parse_args():
+	""" Parses command line arguments.
+	Returns:
+		argparse.Namespace : parsed arguments
+	"""
+	parser = argparse.ArgumentParser(
+		description='Classify EGFR and ALK test use, result, and method.')
+	parser.add_argument('input', help='path to tab delimited input file')
+	parser.add_argument(
+		'--workers', type=int, default=1,
+		help='number of worker processes to classify with (default: 1, serial)')
+	parser.add_argument(
+		'--chunk-size', type=int, default=BATCH,
+		help='rows read and classified per chunk, per worker (default: {})'.format(
+			BATCH))
+	parser.add_argument(
+		'--max-cases', type=int, default=None,
+		help='patient/tumor cases held in memory before case-level state is ' +
+		'spilled to sqlite (default: never spill)')
+	parser.add_argument(
+		'--case-store', default=None,
+		help='sqlite file to spill case-level state to; kept after the run ' +
+		'(default: a temporary file)')
+	parser.add_argument(
+		'--native', action='store_true',
+		help='score linear models directly instead of through sklearn predict')
+	parser.add_argument(
+		'--cache', default=None,
+		help='sqlite file of labels from earlier runs; reports already in it ' +
+		'are not reclassified (default: no cache)')
+	parser.add_argument(
+		'--cache-size', type=int, default=1000000,
+		help='labels kept in the cache before the least recently used are ' +
+		'evicted (default: 1000000)')
+	parser.add_argument(
+		'--state', default=None,
+		help='sqlite file of record labels and case-level status kept across ' +
+		'runs; the input is then a delta of new or changed records and the ' +
+		'case-level output is rewritten from the updated state')
+	parser.add_argument(
+		'--profile', default=None,
+		help='file to write per-stage timings, regex hit counts and time, and ' +
+		'the slowest documents to, as CSV if it ends in .csv and JSON otherwise; ' +
+		'also logs records/sec while running (serial runs only)')
+	parser.add_argument(
+		'--safe', type=float, nargs='?', const=BUDGET, default=None,
+		metavar='SECONDS',
+		help='guard regexes that can backtrack for seconds on long lines and ' +
+		'skip them once a document has taken SECONDS (default: {})'.format(BUDGET))
+	parser.add_argument(
+		'--windowed', nargs='?', const='on', default=None, choices=['on', 'verify'],
+		help='normalize only the lines around marker mentions when that gives ' +
+		'the same vector; with "verify", also normalize whole reports, log ' +
+		'reports whose vectors differ and keep the whole-report vector')
+	parser.add_argument(
+		'--output', default='tsv', choices=FORMATS,
+		help='format of record and case level output: tab delimited text, ' +
+		'newline delimited JSON, or both as tables of one sqlite database ' +
+		'(default: tsv)')
+	parser.add_argument(
+		'--checkpoint', default=None, metavar='FILE',
+		help='sqlite file to save progress to every --checkpoint-every rows: ' +
+		'input read, output written and case-level status; removed once the ' +
+		'run completes')
+	parser.add_argument(
+		'--checkpoint-every', type=int, default=EVERY, metavar='N',
+		help='rows processed between checkpoints (default: {})'.format(EVERY))
+	parser.add_argument(
+		'--resume', action='store_true',
+		help='continue from the last checkpoint in the --checkpoint file, or ' +
+		'start from the beginning if there is none')
+	parser.add_argument(
+		'--quarantine', default=None, metavar='FILE',
+		help='tab delimited file to write rows whose length differs from the ' +
+		'headers to, each led by its line number, instead of stopping')
+	parser.add_argument(
+		'--patients', default=None, metavar='FILE',
+		help='file of whitespace separated patient IDs; only their records ' +
+		'are processed (default: all patients)')
+	parser.add_argument(
+		'--records', default=None, metavar='FILE',
+		help='file of whitespace separated record IDs; only these records ' +
+		'are processed (default: all records)')
+	parser.add_argument(
+		'--skip', default=None, metavar='FILE',
+		help='file of whitespace separated cases (patient ID and tumor ' +
+		'record joined by "_") whose records are not processed')
+	args = parser.parse_args()
+	if args.state and (args.max_cases is not None or args.case_store):
+		parser.error('--state already keeps case-level state on disk; ' +
+			'--max-cases and --case-store do not apply')
+	if args.profile and args.workers > 1:
+		parser.error('--profile times stages in this process; use --workers 1')
+	if args.safe is not None and args.safe <= 0:
+		parser.error('--safe budget must be positive')
+	if args.workers < 1:
+		parser.error('--workers must be at least 1')
+	if args.chunk_size < 1:
+		parser.error('--chunk-size must be at least 1')
+	if args.max_cases is not None and args.max_cases < 1:
+		parser.error('--max-cases must be at least 1')
+	if args.cache_size < 1:
+		parser.error('--cache-size must be at least 1')
+	if args.resume and not args.checkpoint:
+		parser.error('--resume needs the --checkpoint file to resume from')
+	if args.checkpoint_every < 1:
+		parser.error('--checkpoint-every must be at least 1')
+	return args
 
-def get_dirs():
+
+def get_dirs(input_file, output='tsv', subsets=None):
 	""" Create or verify directories for models, input, and output.
 	Assign paths for files.
+	Args:
+		input_file (str) : path to input file
+		output (str) : output format, one of utils.writers.FORMATS
+		subsets (Subsets) : subsets of rows processed, or None for all rows
 	Returns:
 		dict (str:str) : type of file mapped to file path
 	"""
 	dirs = {}
 	home = os.path.dirname(os.path.normpath(os.path.realpath(__file__)))
-	# get input file
-	try:
-		dirs['input'] = sys.argv[1]
-	except IndexError:
-		raise IndexError('Provide path to input file as first argument.')
-	# establish output dir and files
-	output_dir = os.path.join(home, 'output')
-	try:
-		os.mkdir(output_dir)
-	except OSError:
-		pass
-	flag = '_' + rd_file if rd_subset else ''  # compile flag to mark output type
-	flag += '_' + pt_file if pt_subset else ''
-	flag += '_' + skip_file if skip_set else ''
-	flag = 'all' if not flag else flag
-	dirs['record level'] = os.path.join(
-		output_dir, 'record_level_output{}.txt'.format(flag))
-	dirs['case level'] = os.path.join(
-		output_dir, 'case_level_output{}.txt'.format(flag))
+	dirs['input'] = input_file
+	dirs.update(get_outputs(output, subsets))
 	# establish model files
 	model_dir = os.path.join(home, 'models')
 	if not os.path.exists(model_dir):
 		sys.stderr.write('Model directory not found.\nExiting...\n')
 		sys.exit()
 	dirs['model'] = model_dir
+	dirs['patterns'] = os.path.join(home, 'utils', 'patterns')
 	return dirs
 
 
-def process_records(dirs):
+def get_outputs(output='tsv', subsets=None):
+	""" Create or verify the output directory and assign paths for the
+	record level and case level output files.
+	Args:
+		output (str) : output format, one of utils.writers.FORMATS
+		subsets (Subsets) : subsets of rows processed, or None for all rows
+	Returns:
+		dict (str:str) : output level mapped to file path
+	"""
+	home = os.path.dirname(os.path.normpath(os.path.realpath(__file__)))
+	output_dir = os.path.join(home, 'output')
+	try:
+		os.mkdir(output_dir)
+	except OSError:
+		pass
+	flag = subsets.flag() if subsets else 'all'  # flag to mark output type
+	if output == 'sqlite':
+		# both levels are tables of one database (see TABLES)
+		path = os.path.join(output_dir, 'output{}.sqlite'.format(flag))
+		return {'record level': path, 'case level': path}
+	return {
+		'record level': os.path.join(
+			output_dir, 'record_level_output{}{}'.format(flag, EXTENSIONS[output])),
+		'case level': os.path.join(
+			output_dir, 'case_level_output{}{}'.format(flag, EXTENSIONS[output]))}
+
+
+def process_records(
+		dirs, workers=1, chunk_size=BATCH, cases=None, native=False, cache=None,
+		profiler=None, safe=None, windowed=None, output='tsv', subsets=None,
+		checkpoint=None, progress=None, quarantine=None):
 	""" Processes pathology reports, writes record-level results to file and
-	iteratively determines patient level genetic testing status.
+	iteratively determines patient level genetic testing status. Input is
+	streamed in chunks of chunk_size rows, so only one chunk of report text
+	is held in memory at a time. Rows outside subsets are dropped as they are
+	read (see utils/readers.py). With a checkpoint, progress is saved every
+	so many rows and a run can resume from the progress saved.
 	Args:
 		dirs (dict str:str) : type of file mapped to file path
+		workers (int) : number of worker processes, 1 to classify serially
+		chunk_size (int) : number of rows classified together, per worker
+		cases (dict, CaseStore or CaseHistory) : store for case-level status,
+			a new dict if not given
+		native (bool) : score linear models directly rather than via sklearn
+		cache (ResultCache) : labels of reports seen in earlier runs, or None
+		profiler (Profiler) : collector of vectorizer timings and records/sec,
+			or None; only used when classifying serially
+		safe (float) : per-document budget in seconds to vectorize in safe
+			mode with (see utils/safe_regex.py), or None
+		windowed (str) : 'on' or 'verify' to vectorize in windowed mode (see
+			Vectorizer._normalize_window), or None
+		output (str) : format of record-level output (see utils/writers.py)
+		subsets (Subsets) : subsets of rows to process, or None for all rows
+		checkpoint (Checkpoint) : file to save progress to, or None
+		progress (dict) : progress saved by the checkpoint to resume from
+			(see start_checkpoint), or None to start from the beginning
+		quarantine (Quarantine) : file to write rows whose length differs
+			from the headers to, or None to raise an error on them
 	Returns:
 		dict (str:str:(str, str)) :
 			patient ID mapped to gen marker and status with deciding report ID
 	"""
-	classifier = GenTestClassifier(dirs['model'])
-	vectorizer = Vectorizer()
-	cases = {}
-	with open(dirs['input'], 'r') as fin, open(dirs['record level'], 'w') as fout:
-		reader = csv.reader(fin, delimiter='\t')
+	if cases is None:
+		cases = {}
+	csv.field_size_limit(FIELD_LIMIT)
+	with open(dirs['input'], 'r') as fin:
+		reader = SubsetReader(fin)
 		headers = reader.next()
-		row_length = len(headers)
-		# write headers
-		fout.write('\t'.join(
-			headers[:get(headers, TEXT)] + headers[get(headers, TEXT) + 1:]))
+		columns = plan_columns(headers)
+		reader.filter(
+			subsets, columns.patient, columns.record, columns.tumor, len(headers))
+		if progress is not None:
+			reader.seek(progress['offset'], progress['line_num'], progress['skipped'])
+		output_headers = headers[:columns.text] + headers[columns.text + 1:]
 		for marker in MARKERS:
 			for cat in 'Reported', 'Result', 'Method':
-				fout.write('\t{} {}'.format(marker, cat))
-		fout.write('\n')
-		sys.stderr.write('Log based on {} total records\n'.format(TOTAL))
-		mark = 10
-		num_processed = 0
-		for row in reader:
-			if len(row) != row_length:
-				message = 'Differing row lengths detected. ' +\
-					'Please check input data. [row index={}]\n'.format(reader.line_num)
-				raise IOError(message)
-
-			cases = process_row(fout, headers, row, cases, classifier, vectorizer)
-
-			num_processed += 1
-			percentage = num_processed * 100.0 / TOTAL
-			if percentage > mark:
-				sys.stderr.write('{}% of records processed...\n'.format(mark))
-				mark += 10
+				output_headers.append('{} {}'.format(marker, cat))
+		with open_writer(
+				output, dirs['record level'], TABLES['record level'], output_headers,
+				resume=None if progress is None else progress['records']) as writer:
+			sys.stderr.write('Log based on {} total records\n'.format(TOTAL))
+			rows = log_progress(check_rows(reader, len(headers), quarantine), profiler)
+			save = None
+			if checkpoint is not None:
+				save = functools.partial(
+					save_checkpoint, checkpoint, reader, writer, quarantine)
+			if workers > 1:
+				cases = process_parallel(
+					writer, columns, rows, cases, dirs['model'], workers, chunk_size,
+					native, cache, safe, windowed, save)
+			else:
+				classifier = GenTestClassifier(dirs['model'], native)
+				vectorizer = make_vectorizer(safe, windowed)
+				if profiler is not None:
+					vectorizer.instrument(profiler)
+				classify = lambda reports: classify_reports(reports, classifier, vectorizer)
+				cases = process_batches(
+					writer, columns, rows, cases, classify, chunk_size, cache, save)
+				if vectorizer.budget is not None:
+					sys.stderr.write(
+						'Safe mode: {} regex runs capped on long lines, '.format(
+							vectorizer.budget.capped) +
+						'{} skipped over the time budget\n'.format(vectorizer.budget.skipped))
+				if vectorizer.windowed:
+					windows = vectorizer.windows
+					sys.stderr.write(
+						'Windowed mode: {} normalized by window, {} in full'.format(
+							windows.windowed, windows.full) +
+						(', {} differed from the full vector\n'.format(windows.mismatched)
+							if vectorizer.verify else '\n'))
+			if save is not None:
+				save(cases, [], True)
 	sys.stderr.write('100% of records processed\n')
+	if reader.skipped:
+		sys.stderr.write('{} records outside subsets skipped\n'.format(reader.skipped))
 	sys.stderr.write(
 		'Record level results written to:\n{}\n'.format(dirs['record level']))
 	return cases
 
 
-def process_row(fout, headers, row, cases, classifier, vectorizer):
+def plan_columns(headers):
+	""" Resolves the position of every field read from a row, once for all
+	rows. If a field cannot be found, exits with error message.
+	Args:
+		headers (list of str) : list of headers
+	Returns:
+		Columns : position of accession number, tumor record, record ID,
+			patient ID and report text fields
+	"""
+	return Columns(*[get(headers, field) for field in (ACC, TUMOR, REC, PAT, TEXT)])
+
+
+def check_rows(reader, row_length, quarantine=None):
+	""" Yields rows from reader, raising an error on rows whose length
+	differs from the headers, or writing them to quarantine if given.
+	Args:
+		reader (csv.reader or SubsetReader) : reader positioned after the headers
+		row_length (int) : number of fields in headers
+		quarantine (Quarantine) : file to write rows of differing length to,
+			or None to raise an error on them
+	Yields:
+		list of str : row as list
+	"""
+	for row in reader:
+		if len(row) != row_length:
+			if quarantine is not None:
+				quarantine.add(reader.line_num, row)
+				continue
+			message = 'Differing row lengths detected. ' +\
+				'Please check input data. [row index={}]\n'.format(reader.line_num)
+			raise IOError(message)
+		yield row
+
+
+def log_progress(rows, profiler=None):
+	""" Yields rows unchanged, logging every 10% of TOTAL to stderr.
+	Args:
+		rows (iterable of list of str) : rows to pass through
+		profiler (Profiler) : counts rows for its records/sec readout, or None
+	Yields:
+		list of str : row as list
+	"""
+	mark = 10
+	num_processed = 0
+	for row in rows:
+		yield row
+		num_processed += 1
+		if profiler is not None:
+			profiler.record()
+		percentage = num_processed * 100.0 / TOTAL
+		if percentage > mark:
+			sys.stderr.write('{}% of records processed...\n'.format(mark))
+			mark += 10
+
+
+def process_row(writer, columns, row, cases, classifier, vectorizer):
 	""" Processes a single row in input file. Classifies report and
 	resolves output, writing output to record-level file. Updates patient
 	level result status.
 	Args:
-		fout (file) : open filestream to output file
-		headers (list of str) : list of headers
+		writer (TableWriter) : record-level output (see utils/writers.py)
+		columns (Columns) : positions of fields (see plan_columns)
 		row (list of str) : row as list
 		cases (dict str:str:(str, str)) :
 			patient ID mapped to gen marker and status with deciding report ID
@@ -154,58 +437,378 @@ def process_row(fout, headers, row, cases, classifier, vectorizer):
 			patient ID mapped to gen marker and status with deciding report ID,
 			updated according to result for this row
 	"""
-	accession = row[get(headers, ACC)]
-	tumor = row[get(headers, TUMOR)]
-	record = row[get(headers, REC)]
-	patient = row[get(headers, PAT)]
-	text = row.pop(get(headers, TEXT))
-	case = '{}_{}'.format(patient, tumor)
-	if pt_subset and patient not in pt_subset:
-		return cases
-	if rd_subset and record not in rd_subset:
-		return cases
-	if skip_set and case in skip_set:
-		return cases
-	fout.write('\t'.join(row))
-	for marker in MARKERS:
-		cases.setdefault(case, {}).setdefault(marker, ('Unknown', 'N/A'))
-		vector = vectorizer.make_vector(text, accession, marker)
-		reported, result, method = classifier.classify(vector)
-		fout.write('\t' + '\t'.join([reported, result, method]))
+	accession, case, record, text = select_row(columns, row)
+	labels = classify_reports([(text, accession)], classifier, vectorizer)[0]
+	return resolve_row(writer, row, case, record, labels, cases)
+
+
+def select_row(columns, row):
+	""" Pulls the fields needed for classification out of a row, removing the
+	report text from the row. Rows outside the subsets are left out by the
+	reader (see utils/readers.py).
+	Args:
+		columns (Columns) : positions of fields (see plan_columns)
+		row (list of str) : row as list
+	Returns:
+		(str, str, str, str) : accession number, case ID, record ID and report
+			text
+	"""
+	case = '{}_{}'.format(row[columns.patient], row[columns.tumor])
+	return row[columns.accession], case, row[columns.record], row.pop(columns.text)
+
+
+def classify_reports(reports, classifier, vectorizer):
+	""" Classifies pathology reports for every marker, classifying the
+	vectors of all reports and markers as one batch. Markers a report
+	provably never mentions are labeled not reported without building or
+	classifying a vector, which gives the same labels as classifying it.
+	Args:
+		reports (list of (str, str)) :
+			raw text and accession number of each pathology report
+		classifier (Classifier) : classifier object
+		vectorizer (Vectorizer) : vectorizing object
+	Returns:
+		list of list of (str, str, str) : for each report, reported, result
+			and method for each marker in MARKERS order
+	"""
+	labels = [NOT_REPORTED] * (len(reports) * len(MARKERS))
+	positions = []  # index in labels of each vector to classify
+	vectors = []
+	for index, (text, accession) in enumerate(reports):
+		marker_vectors = vectorizer.make_vectors(text, accession, MARKERS, True)
+		for offset, marker in enumerate(MARKERS):
+			if marker_vectors[marker] is not None:
+				positions.append(index * len(MARKERS) + offset)
+				vectors.append(marker_vectors[marker])
+	if vectors:
+		for position, marker_labels in zip(positions, classifier.classify_batch(vectors)):
+			labels[position] = marker_labels
+	return [
+		labels[i:i + len(MARKERS)] for i in range(0, len(labels), len(MARKERS))]
+
+
+def resolve_row(writer, row, case, record, labels, cases):
+	""" Writes a classified row to the record-level file and updates patient
+	level result status.
+	Args:
+		writer (TableWriter) : record-level output (see utils/writers.py)
+		row (list of str) : row as list, without report text
+		case (str) : patient ID and tumor ID of row
+		record (str) : record ID of row
+		labels (list of (str, str, str)) :
+			reported, result and method for each marker in MARKERS order
+		cases (dict str:str:(str, str)) :
+			patient ID mapped to gen marker and status with deciding report ID;
+			a CaseHistory records the labels and resolves cases later
+	Returns:
+		cases (dict str:str:(str, str)) :
+			patient ID mapped to gen marker and status with deciding report ID,
+			updated according to result for this row
+	"""
+	writer.write(row + [label for marker_labels in labels for label in marker_labels])
+	if isinstance(cases, CaseHistory):
+		cases.add(case, record, labels)
+	else:
+		cases[case] = update_status(cases.get(case, {}), record, labels)
+	return cases
+
+
+def update_status(status, record, labels):
+	""" Updates the status of a case with the labels of one of its records.
+	Args:
+		status (dict str:(str, str)) :
+			gen marker mapped to status with deciding report ID
+		record (str) : record ID
+		labels (list of (str, str, str)) :
+			reported, result and method for each marker in MARKERS order
+	Returns:
+		dict (str:(str, str)) : status updated according to result for record
+	"""
+	for marker, (reported, result, method) in zip(MARKERS, labels):
+		status.setdefault(marker, ('Unknown', 'N/A'))
 		# take only first positive
-		if cases[case][marker] == 'Positive':
+		if status[marker] == 'Positive':
 			continue
 		# take any ALK result or an EGFR result by mutational analysis
 		if result == 'Positive':
 			if marker == 'ALK' or method == 'Mutational Analysis':
-				cases[case][marker] = (result, record)
-		if cases[case][marker] == 'Negative':
+				status[marker] = (result, record)
+		if status[marker] == 'Negative':
 			continue
 		if result == 'Negative':
 			if marker == 'ALK' or method == 'Mutational Analysis':
-				cases[case][marker] = (result, record)
-	fout.write('\n')
+				status[marker] = (result, record)
+	return status
+
+
+def process_batches(
+		writer, columns, rows, cases, classify, size, cache=None, checkpoint=None):
+	""" Selects rows and classifies them in batches, writing and resolving
+	results in input order.
+	Args:
+		writer (TableWriter) : record-level output (see utils/writers.py)
+		columns (Columns) : positions of fields (see plan_columns)
+		rows (iterable of list of str) : rows to process
+		cases (dict str:str:(str, str)) :
+			patient ID mapped to gen marker and status with deciding report ID
+		classify (function) : maps a list of (text, accession) reports to
+			their labels, as classify_reports does
+		size (int) : number of selected rows per batch
+		cache (ResultCache) : labels of reports seen in earlier runs; only
+			reports missing from it are classified
+		checkpoint (function) : called with cases and the case IDs of each
+			batch once resolved (see save_checkpoint), or None
+	Returns:
+		cases (dict str:str:(str, str)) :
+			patient ID mapped to gen marker and status with deciding report ID
+	"""
+	if cache is not None:
+		classify = functools.partial(classify_cached, classify=classify, cache=cache)
+	batch = []
+	for row in rows:
+		batch.append((row, select_row(columns, row)))
+		if len(batch) == size:
+			cases = resolve_batch(writer, batch, cases, classify, checkpoint)
+			batch = []
+	return resolve_batch(writer, batch, cases, classify, checkpoint)
+
+
+def resolve_batch(writer, batch, cases, classify, checkpoint=None):
+	""" Classifies a batch of selected rows and resolves them in order.
+	Args:
+		writer (TableWriter) : record-level output (see utils/writers.py)
+		batch (list of (list of str, tuple)) : rows with their selected fields
+		cases (dict str:str:(str, str)) :
+			patient ID mapped to gen marker and status with deciding report ID
+		classify (function) : maps a list of (text, accession) reports to
+			their labels
+		checkpoint (function) : called with cases and the case IDs of the
+			batch once resolved, or None
+	Returns:
+		cases (dict str:str:(str, str)) :
+			patient ID mapped to gen marker and status with deciding report ID
+	"""
+	if not batch:
+		return cases
+	reports = [(text, accession) for row, (accession, case, record, text) in batch]
+	for (row, (accession, case, record, text)), labels in zip(batch, classify(reports)):
+		cases = resolve_row(writer, row, case, record, labels, cases)
+	if checkpoint is not None:
+		checkpoint(cases, [case for row, (accession, case, record, text) in batch])
 	return cases
 
 
-def process_patients(cases, file):
-	""" Write patient-level results to file.
+def start_checkpoint(checkpoint, resume, cases):
+	""" Starts saving progress to a checkpoint, resuming from the progress it
+	holds if asked to. Case status saved by the checkpoint is restored into
+	cases; a CaseHistory keeps its own, committed at every checkpoint.
+	Args:
+		checkpoint (Checkpoint) : file to save progress to
+		resume (bool) : whether to resume from the progress saved
+		cases (dict, CaseStore or CaseHistory) : empty store for case-level
+			status
+	Returns:
+		dict (str:int) : position of reader, record level output and
+			quarantine to resume from, or None to start from the beginning
+	"""
+	progress = checkpoint.load() if resume else None
+	if progress is None:
+		if resume:
+			sys.stderr.write('No checkpoint in {}, starting from the beginning\n'.format(
+				checkpoint.path))
+		checkpoint.reset()
+		return None
+	if not isinstance(cases, CaseHistory):
+		cases.clear()
+		for case, status in checkpoint.cases():
+			cases[case] = status
+	sys.stderr.write('Resuming after line {} of input\n'.format(progress['line_num']))
+	return progress
+
+
+def save_checkpoint(checkpoint, reader, writer, quarantine, cases, batch, final=False):
+	""" Notes the cases of a resolved batch and saves a checkpoint once one is
+	due, or if final. Every row read so far has been resolved, so the reader
+	is between rows.
 	Args:
+		checkpoint (Checkpoint) : file to save progress to
+		reader (SubsetReader) : reader of input
+		writer (TableWriter) : record-level output (see utils/writers.py)
+		quarantine (Quarantine) : file of rows of differing length, or None
+		cases (dict, CaseStore or CaseHistory) : case-level status
+		batch (list of str) : case ID of each row of the batch
+		final (bool) : whether to save even if no checkpoint is due
+	"""
+	if not checkpoint.add(batch) and not final:
+		return
+	if isinstance(cases, CaseHistory):
+		# resolving commits the state file, which holds status of its own
+		cases.resolve(update_status)
+		statuses = []
+	else:
+		statuses = [(case, cases.get(case)) for case in checkpoint.touched]
+	checkpoint.save({
+		'offset': reader.offset,
+		'line_num': reader.line_num,
+		'skipped': reader.skipped,
+		'records': writer.sync(),
+		'quarantine': None if quarantine is None else quarantine.sync(),
+		'quarantined': 0 if quarantine is None else quarantine.count}, statuses)
+
+
+def process_parallel(
+		writer, columns, rows, cases, model_dir, workers, chunk_size, native=False,
+		cache=None, safe=None, windowed=None, checkpoint=None):
+	""" Classifies rows on a pool of worker processes, each of which loads
+	the classifier and vectorizer once. Each batch is split into chunks
+	across the workers and results are written and resolved in input order,
+	so output matches a serial run.
+	Args:
+		writer (TableWriter) : record-level output (see utils/writers.py)
+		columns (Columns) : positions of fields (see plan_columns)
+		rows (iterable of list of str) : rows to process
 		cases (dict str:str:(str, str)) :
+			patient ID mapped to gen marker and status with deciding report ID
+		model_dir (str) : path to model directory
+		workers (int) : number of worker processes
+		chunk_size (int) : number of rows classified together, per worker
+		native (bool) : score linear models directly rather than via sklearn
+		cache (ResultCache) : labels of reports seen in earlier runs, or None;
+			looked up in this process so workers only see cache misses
+		safe (float) : per-document budget in seconds of safe mode, or None
+		windowed (str) : 'on' or 'verify' for windowed mode, or None
+		checkpoint (function) : called with cases and the case IDs of each
+			batch once resolved (see save_checkpoint), or None
+	Returns:
+		cases (dict str:str:(str, str)) :
+			patient ID mapped to gen marker and status with deciding report ID
+	"""
+	# compile the shared pattern tables here so forked workers inherit them
+	make_vectorizer(safe)
+	pool = multiprocessing.Pool(
+		workers, init_worker, (model_dir, native, safe, windowed))
+	try:
+		classify = lambda reports: classify_on_pool(reports, pool, workers)
+		cases = process_batches(
+			writer, columns, rows, cases, classify, workers * chunk_size, cache,
+			checkpoint)
+	except BaseException:
+		pool.terminate()
+		raise
+	pool.close()
+	pool.join()
+	return cases
+
+
+def classify_cached(reports, classify, cache):
+	""" Returns cached labels for reports already seen, classifying the rest
+	and adding them to the cache. A report is reclassified unless the labels
+	of every marker are cached.
+	Args:
+		reports (list of (str, str)) :
+			raw text and accession number of each pathology report
+		classify (function) : maps a list of (text, accession) reports to
+			their labels
+		cache (ResultCache) : labels of reports seen in earlier runs
+	Returns:
+		list of list of (str, str, str) : labels for each report, in order
+	"""
+	keys = []
+	for text, accession in reports:
+		text = get_text(text)
+		keys.append([cache.key(text, accession, marker) for marker in MARKERS])
+	found = cache.get_many([key for report_keys in keys for key in report_keys])
+	labels = [[found.get(key) for key in report_keys] for report_keys in keys]
+	missing = [i for i, report_labels in enumerate(labels) if None in report_labels]
+	if missing:
+		new = {}
+		for i, report_labels in zip(missing, classify([reports[i] for i in missing])):
+			labels[i] = report_labels
+			new.update(zip(keys[i], report_labels))
+		cache.put_many(new)
+	return labels
+
+
+def classify_on_pool(reports, pool, workers):
+	""" Classifies reports on a pool, one chunk per task.
+	Args:
+		reports (list of (str, str)) :
+			raw text and accession number of each pathology report
+		pool (multiprocessing.Pool) : pool of initialized workers
+		workers (int) : number of worker processes in pool
+	Returns:
+		list of list of (str, str, str) : labels for each report, in order
+	"""
+	size = max(1, -(-len(reports) // (workers * 4)))
+	chunks = [reports[i:i + size] for i in range(0, len(reports), size)]
+	return [
+		labels for chunk in pool.map(classify_in_worker, chunks) for labels in chunk]
+
+
+_worker = {}  # classifier and vectorizer loaded once per worker process
+
+
+def init_worker(model_dir, native=False, safe=None, windowed=None):
+	""" Loads the classifier and vectorizer in a worker process. The
+	vectorizer reuses pattern tables inherited from the parent if forked.
+	Args:
+		model_dir (str) : path to model directory
+		native (bool) : score linear models directly rather than via sklearn
+		safe (float) : per-document budget in seconds of safe mode, or None
+		windowed (str) : 'on' or 'verify' for windowed mode, or None
+	"""
+	_worker['classifier'] = GenTestClassifier(model_dir, native)
+	_worker['vectorizer'] = make_vectorizer(safe, windowed)
+
+
+def make_vectorizer(safe=None, windowed=None):
+	""" Returns a vectorizer, in safe mode if a budget is given.
+	Args:
+		safe (float) : per-document budget in seconds of safe mode (see
+			utils/safe_regex.py), or None to run every regex unguarded
+		windowed (str) : 'on' to normalize only around marker mentions where
+			possible, 'verify' to also check against whole reports, or None
+	Returns:
+		Vectorizer : vectorizing object
+	"""
+	options = {'windowed': windowed is not None, 'verify': windowed == 'verify'}
+	if safe is None:
+		return Vectorizer(**options)
+	return Vectorizer(safe=True, budget=safe, **options)
+
+
+def classify_in_worker(reports):
+	""" Classifies reports with the worker's classifier and vectorizer.
+	Args:
+		reports (list of (str, str)) :
+			raw text and accession number of each pathology report
+	Returns:
+		list of list of (str, str, str) : labels for each report
+	"""
+	return classify_reports(
+		reports, _worker['classifier'], _worker['vectorizer'])
+
+
+def process_patients(cases, file, output='tsv'):
+	""" Write patient-level results to file.
+	Args:
+		cases (dict, CaseStore or CaseHistory str:str:(str, str)) :
 			patient ID and tumor ID mapped to gen marker
 			and status with deciding report ID
 		file (str) : path to case level output file
+		output (str) : format of output (see utils/writers.py)
 	"""
-	with open(file, 'w') as f:
-		f.write('patient_id')
-		for marker in MARKERS:
-			f.write('\t{} Result\t{} Record ID'.format(marker, marker))
-		f.write('\n')
-		for case in sorted(cases):
-			f.write(case)
-			for marker in MARKERS:
-				f.write('\t{}\t{}'.format(*cases[case][marker]))
-			f.write('\n')
+	if isinstance(cases, (CaseStore, CaseHistory)):
+		items = cases.sorted_items()
+	else:
+		items = sorted(cases.items())
+	headers = ['patient_id']
+	for marker in MARKERS:
+		headers.extend(['{} Result'.format(marker), '{} Record ID'.format(marker)])
+	with open_writer(output, file, TABLES['case level'], headers) as writer:
+		for case, status in items:
+			writer.write([case] + [
+				'{}'.format(value) for marker in MARKERS for value in status[marker]])
 	sys.stderr.write(
 		'Case level results written to:\n{}\n'.format(file))
 
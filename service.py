@@ -0,0 +1,314 @@
+# -*- coding: utf-8 -*-
+
+"""
+author@kathrynegan
+
+Copyright (c) 2015-2017 Fred Hutchinson Cancer Research Center
+
+Licensed under the Apache License, Version 2.0: http://www.apache.org/licenses/LICENSE-2.0
+
+service.py serves EGFR and ALK classification over local HTTP, keeping the
+models and compiled regexes loaded between requests. Reports from concurrent
+requests are gathered into micro-batches so the models predict once per batch.
+
+Usage: python service.py [--host HOST] [--port PORT] [--models DIR]
+	[--native] [--warm-up] [--safe [SECONDS]] [--max-batch N] [--max-wait MS]
+
+POST /classify with {"text": ..., "accession": ...} returns {"labels": ...},
+or with {"reports": [{"text": ..., "accession": ...}, ...]} returns
+{"results": [{"labels": ...}, ...]}. Labels map each marker to its reported,
+result and method. GET /metrics returns request, report and batch counts,
+throughput and latency percentiles; GET /health returns {"status": "ok"}.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import collections
+try:
+	from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+	from SocketServer import ThreadingMixIn
+	import Queue as queue
+except ImportError:
+	from http.server import BaseHTTPRequestHandler, HTTPServer
+	from socketserver import ThreadingMixIn
+	import queue
+from run import MARKERS, BATCH, classify_reports, make_vectorizer
+from utils.gentest_classifier import GenTestClassifier
+from utils.safe_regex import BUDGET
+
+MAX_WAIT = 2.0  # milliseconds a batch waits for more reports
+LATENCY_WINDOW = 10000  # most recent request latencies kept for percentiles
+
+
+def main():
+	args = parse_args()
+	classifier = GenTestClassifier(args.models, args.native, args.warm_up)
+	vectorizer = make_vectorizer(args.safe)
+	batcher = Batcher(
+		lambda reports: classify_reports(reports, classifier, vectorizer),
+		args.max_batch, args.max_wait / 1000.0)
+	batcher.start()
+	server = Server((args.host, args.port), Handler)
+	server.batcher = batcher
+	server.metrics = batcher.metrics
+	sys.stderr.write('Serving on http://{}:{}\n'.format(*server.server_address))
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		server.server_close()
+
+
+def parse_args():
+	""" Parses command line arguments.
+	Returns:
+		argparse.Namespace : parsed arguments
+	"""
+	home = os.path.dirname(os.path.normpath(os.path.realpath(__file__)))
+	parser = argparse.ArgumentParser(
+		description='Serve EGFR and ALK classification over HTTP.')
+	parser.add_argument('--host', default='127.0.0.1', help='address to bind')
+	parser.add_argument('--port', type=int, default=8080, help='port to bind')
+	parser.add_argument(
+		'--models', default=os.path.join(home, 'models'), help='model directory')
+	parser.add_argument(
+		'--native', action='store_true',
+		help='score linear models directly instead of through sklearn predict')
+	parser.add_argument(
+		'--warm-up', action='store_true',
+		help='load every model before serving instead of on first use')
+	parser.add_argument(
+		'--safe', type=float, nargs='?', const=BUDGET, default=None,
+		metavar='SECONDS', help='vectorize in safe mode (see run.py --safe)')
+	parser.add_argument(
+		'--max-batch', type=int, default=BATCH,
+		help='reports classified together at most (default: {})'.format(BATCH))
+	parser.add_argument(
+		'--max-wait', type=float, default=MAX_WAIT,
+		help='milliseconds a batch waits for more reports (default: {})'.format(
+			MAX_WAIT))
+	args = parser.parse_args()
+	if not os.path.exists(args.models):
+		parser.error('model directory not found: {}'.format(args.models))
+	if args.max_batch < 1:
+		parser.error('--max-batch must be at least 1')
+	if args.max_wait < 0:
+		parser.error('--max-wait cannot be negative')
+	if args.safe is not None and args.safe <= 0:
+		parser.error('--safe budget must be positive')
+	return args
+
+
+class Batcher(threading.Thread):
+	""" Thread that owns the classifier and vectorizer. Reports submitted by
+	request threads queue up; whatever arrives within max_wait of the first
+	report, up to max_batch reports, is classified as one batch. """
+
+	def __init__(self, classify, max_batch=BATCH, max_wait=MAX_WAIT / 1000.0):
+		""" Initializes Batcher instance.
+		Args:
+			classify (function) : maps a list of (text, accession) reports to
+				their labels, as run.classify_reports does
+			max_batch (int) : reports classified together at most
+			max_wait (float) : seconds a batch waits for more reports
+		"""
+		threading.Thread.__init__(self)
+		self.daemon = True
+		self.classify = classify
+		self.max_batch = max_batch
+		self.max_wait = max_wait
+		self.pending = queue.Queue()
+		self.metrics = Metrics()
+
+	def submit(self, reports):
+		""" Classifies reports in the next batch, blocking until done.
+		Args:
+			reports (list of (str, str)) : text and accession number of reports
+		Returns:
+			list of list of (str, str, str) : labels for each report
+		"""
+		request = _Request(reports)
+		self.pending.put(request)
+		request.done.wait()
+		if request.error is not None:
+			raise request.error
+		return request.labels
+
+	def run(self):
+		while True:
+			batch = [self.pending.get()]
+			size = len(batch[0].reports)
+			deadline = time.time() + self.max_wait
+			while size < self.max_batch:
+				remaining = deadline - time.time()
+				try:
+					if remaining <= 0:
+						request = self.pending.get_nowait()
+					else:
+						request = self.pending.get(timeout=remaining)
+				except queue.Empty:
+					break
+				batch.append(request)
+				size += len(request.reports)
+			self._classify(batch)
+			self.metrics.add_batch(size)
+
+	def _classify(self, batch):
+		""" Classifies the reports of every request in batch at once and
+		hands each request its labels.
+		Args:
+			batch (list of _Request) : requests to classify
+		"""
+		try:
+			labels = self.classify(
+				[report for request in batch for report in request.reports])
+		except Exception as error:
+			for request in batch:
+				request.error = error
+				request.done.set()
+			return
+		start = 0
+		for request in batch:
+			request.labels = labels[start:start + len(request.reports)]
+			start += len(request.reports)
+			request.done.set()
+
+
+class _Request:
+	""" Tiny class to store the reports of a request until classified. """
+
+	def __init__(self, reports):
+		self.reports = reports
+		self.labels = None
+		self.error = None
+		self.done = threading.Event()
+
+
+class Metrics:
+	""" Thread-safe counts and latencies of requests and batches. """
+
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.start = time.time()
+		self.requests = 0
+		self.reports = 0
+		self.errors = 0
+		self.batches = 0
+		self.batched_reports = 0
+		self.latencies = collections.deque(maxlen=LATENCY_WINDOW)
+
+	def add_request(self, num_reports, seconds, error=False):
+		""" Records a finished request.
+		Args:
+			num_reports (int) : reports in request
+			seconds (float) : time from receiving to answering request
+			error (bool) : whether the request failed
+		"""
+		with self.lock:
+			self.requests += 1
+			self.reports += num_reports
+			self.errors += int(error)
+			self.latencies.append(seconds)
+
+	def add_batch(self, size):
+		""" Records a classified batch of size reports. """
+		with self.lock:
+			self.batches += 1
+			self.batched_reports += size
+
+	def summary(self):
+		""" Returns every measure as a dict for the metrics endpoint. """
+		with self.lock:
+			uptime = time.time() - self.start
+			latencies = sorted(self.latencies)
+			summary = {
+				'uptime_seconds': uptime,
+				'requests': self.requests,
+				'reports': self.reports,
+				'errors': self.errors,
+				'batches': self.batches,
+				'mean_batch_size': self.batched_reports / float(max(self.batches, 1)),
+				'reports_per_second': self.reports / max(uptime, 1e-9)}
+		for percent in 50, 90, 99:
+			index = min(int(len(latencies) * percent / 100.0), len(latencies) - 1)
+			summary['p{}_ms'.format(percent)] = (
+				latencies[index] * 1000 if latencies else 0.0)
+		return summary
+
+
+class Server(ThreadingMixIn, HTTPServer):
+	""" HTTP server answering each request on its own thread. """
+	daemon_threads = True
+
+
+class Handler(BaseHTTPRequestHandler):
+	""" Answers /classify, /metrics and /health. """
+
+	def do_GET(self):
+		if self.path == '/metrics':
+			self._reply(200, self.server.metrics.summary())
+		elif self.path == '/health':
+			self._reply(200, {'status': 'ok'})
+		else:
+			self._reply(404, {'error': 'not found'})
+
+	def do_POST(self):
+		if self.path != '/classify':
+			self._reply(404, {'error': 'not found'})
+			return
+		start = time.time()
+		try:
+			body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+			single = 'reports' not in body
+			reports = [_report(item) for item in ([body] if single else body['reports'])]
+		except (ValueError, KeyError, TypeError, AttributeError) as error:
+			self._reply(400, {'error': 'invalid request: {}'.format(error)})
+			return
+		try:
+			labels = self.server.batcher.submit(reports)
+		except Exception as error:
+			self.server.metrics.add_request(len(reports), time.time() - start, True)
+			self._reply(500, {'error': str(error)})
+			return
+		results = [{'labels': _labels(report_labels)} for report_labels in labels]
+		self.server.metrics.add_request(len(reports), time.time() - start)
+		self._reply(200, results[0] if single else {'results': results})
+
+	def _reply(self, status, content):
+		""" Sends content as a JSON response. """
+		body = json.dumps(content).encode('utf-8')
+		self.send_response(status)
+		self.send_header('Content-Type', 'application/json')
+		self.send_header('Content-Length', str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def log_message(self, format, *args):
+		""" Keeps every request out of stderr. """
+		pass
+
+
+def _report(item):
+	""" Returns the (text, accession) of a report in a request, as bytes on
+	python 2 to match text read from input files. """
+	text, accession = item['text'], item.get('accession', '')
+	if not isinstance(text, str):
+		text = text.encode('utf-8')
+	if not isinstance(accession, str):
+		accession = accession.encode('utf-8')
+	return text, accession
+
+
+def _labels(report_labels):
+	""" Maps each marker to its reported, result and method labels. """
+	return dict(
+		(marker, {'reported': reported, 'result': result, 'method': method})
+		for marker, (reported, result, method) in zip(MARKERS, report_labels))
+
+
+if __name__ == "__main__":
+	main()
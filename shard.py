@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+
+"""
+author@kathrynegan
+
+Copyright (c) 2015-2017 Fred Hutchinson Cancer Research Center
+
+Licensed under the Apache License, Version 2.0: http://www.apache.org/licenses/LICENSE-2.0
+
+shard.py splits an input file into shards that run.py can process on
+separate nodes, and merges the shard outputs into the outputs a single run
+would produce.
+
+Usage: python shard.py split <input file> --shards N [--out DIR]
+	python shard.py merge --records FILE [FILE ...] --cases FILE [FILE ...]
+		[--output {tsv,ndjson,sqlite}]
+
+Rows are assigned to shards by a hash of patient ID and tumor record, so all
+reports of a case land in the same shard and each shard resolves its cases
+(first positive wins, see run.update_status) exactly as a single run would.
+Each shard row carries its row number in the input as an extra column, which
+the merge uses to write record-level rows back in input order before dropping
+it. Case-level rows are merged in case order. Shards must be run with the
+default tab delimited output.
+"""
+import os
+import sys
+import csv
+import zlib
+import heapq
+import argparse
+from run import (
+	PAT, TUMOR, TABLES, FIELD_LIMIT, check_rows, get, get_outputs)
+from utils.writers import FORMATS, open_writer
+
+ORDER = 'shard_input_row'  # name of field holding a row's number in the input
+
+
+def main():
+	args = parse_args()
+	if args.command == 'split':
+		split(args.input, args.shards, args.out)
+	else:
+		merge(args.records, args.cases, args.output)
+
+
+def parse_args():
+	""" Parses command line arguments.
+	Returns:
+		argparse.Namespace : parsed arguments
+	"""
+	parser = argparse.ArgumentParser(
+		description='Split input into shards by case and merge shard outputs.')
+	commands = parser.add_subparsers(dest='command')
+	split_parser = commands.add_parser(
+		'split', help='split an input file into shards by patient/tumor case')
+	split_parser.add_argument('input', help='path to tab delimited input file')
+	split_parser.add_argument(
+		'--shards', type=int, required=True, help='number of shards')
+	split_parser.add_argument(
+		'--out', default=None,
+		help='directory to write shard_<i>.txt files to (default: next to input)')
+	merge_parser = commands.add_parser(
+		'merge', help='merge the outputs of run.py on every shard')
+	merge_parser.add_argument(
+		'--records', nargs='+', required=True,
+		help='record level output file of each shard')
+	merge_parser.add_argument(
+		'--cases', nargs='+', required=True,
+		help='case level output file of each shard')
+	merge_parser.add_argument(
+		'--output', default='tsv', choices=FORMATS,
+		help='format of merged output (default: tsv)')
+	args = parser.parse_args()
+	if args.command == 'split' and args.shards < 1:
+		parser.error('--shards must be at least 1')
+	return args
+
+
+def shard_of(patient, tumor, shards):
+	""" Returns the shard of a case. The hash is stable across processes,
+	machines and python versions, unlike the built-in hash.
+	Args:
+		patient (str) : patient ID
+		tumor (str) : tumor record
+		shards (int) : number of shards
+	Returns:
+		int : shard number, from 0 to shards - 1
+	"""
+	case = '{}_{}'.format(patient, tumor)
+	if not isinstance(case, bytes):
+		case = case.encode('utf-8')
+	return (zlib.crc32(case) & 0xffffffff) % shards
+
+
+def split(input_file, shards, out=None):
+	""" Writes each row of input to the shard of its case, with its row
+	number in the input in an extra ORDER field.
+	Args:
+		input_file (str) : path to tab delimited input file
+		shards (int) : number of shards
+		out (str) : directory to write shards to, or None for the directory
+			of the input file
+	Returns:
+		list of str : paths to shard files
+	"""
+	out = out or os.path.dirname(os.path.abspath(input_file))
+	try:
+		os.makedirs(out)
+	except OSError:
+		pass
+	paths = [os.path.join(out, 'shard_{}.txt'.format(i)) for i in range(shards)]
+	files = [open(path, 'w') for path in paths]
+	try:
+		writers = [
+			csv.writer(fout, delimiter='\t', lineterminator='\n') for fout in files]
+		csv.field_size_limit(FIELD_LIMIT)
+		with open(input_file, 'r') as fin:
+			reader = csv.reader(fin, delimiter='\t')
+			headers = next(reader)
+			patient, tumor = get(headers, PAT), get(headers, TUMOR)
+			for writer in writers:
+				writer.writerow(headers + [ORDER])
+			for index, row in enumerate(check_rows(reader, len(headers))):
+				shard = shard_of(row[patient], row[tumor], shards)
+				writers[shard].writerow(row + [str(index)])
+	finally:
+		for fout in files:
+			fout.close()
+	sys.stderr.write('Shards written to:\n{}\n'.format('\n'.join(paths)))
+	return paths
+
+
+def merge(record_files, case_files, output='tsv'):
+	""" Merges the record level and case level outputs of every shard into
+	the outputs of a single run.
+	Args:
+		record_files (list of str) : record level output file of each shard
+		case_files (list of str) : case level output file of each shard
+		output (str) : format of merged output (see utils/writers.py)
+	"""
+	outputs = get_outputs(output)
+	for path in set(outputs.values()):
+		if any(os.path.abspath(file) == path for file in record_files + case_files):
+			raise IOError(
+				'Merged output would overwrite shard output {}. '.format(path) +
+				'Please move shard outputs out of the output directory.\n')
+	merge_records(record_files, outputs['record level'], output)
+	merge_cases(case_files, outputs['case level'], output)
+
+
+def merge_records(files, path, output='tsv'):
+	""" Writes the record level rows of every shard in input order, without
+	the ORDER field. Each shard is already in input order, so rows are
+	streamed through a k-way merge on ORDER.
+	Args:
+		files (list of str) : record level output file of each shard
+		path (str) : path to merged record level output
+		output (str) : format of merged output (see utils/writers.py)
+	"""
+	shards = [_read_table(file) for file in files]
+	headers = _same_headers(files, [next(shard) for shard in shards])
+	order = get(headers, ORDER)
+	rows = heapq.merge(*[
+		((int(row[order]), row) for row in shard) for shard in shards])
+	with open_writer(
+			output, path, TABLES['record level'],
+			headers[:order] + headers[order + 1:]) as writer:
+		for index, row in rows:
+			writer.write(row[:order] + row[order + 1:])
+	sys.stderr.write('Record level results written to:\n{}\n'.format(path))
+
+
+def merge_cases(files, path, output='tsv'):
+	""" Writes the case level rows of every shard in case order. Each shard
+	is already sorted by case, so rows are streamed through a k-way merge; a
+	case found in more than one shard means the shards were not split by
+	case, and raises an error.
+	Args:
+		files (list of str) : case level output file of each shard
+		path (str) : path to merged case level output
+		output (str) : format of merged output (see utils/writers.py)
+	"""
+	shards = [_read_table(file) for file in files]
+	headers = _same_headers(files, [next(shard) for shard in shards])
+	rows = heapq.merge(*[((row[0], row) for row in shard) for shard in shards])
+	last = None
+	with open_writer(output, path, TABLES['case level'], headers) as writer:
+		for case, row in rows:
+			if case == last:
+				raise IOError(
+					'Case {} found in more than one shard. '.format(case) +
+					'Please split input with shard.py split.\n')
+			writer.write(row)
+			last = case
+	sys.stderr.write('Case level results written to:\n{}\n'.format(path))
+
+
+def _read_table(file):
+	""" Yields the rows of a tab delimited output file, headers first, split
+	on tabs as they were joined when written. """
+	with open(file, 'r') as fin:
+		for line in fin:
+			yield line.rstrip('\n').split('\t')
+
+
+def _same_headers(files, headers):
+	""" Returns the headers shared by every file, raising an error if a file
+	differs. """
+	for file, file_headers in zip(files, headers):
+		if file_headers != headers[0]:
+			raise IOError(
+				'Headers of {} differ from {}. '.format(file, files[0]) +
+				'Please check shard outputs.\n')
+	return headers[0]
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+
+"""
+author@kathrynegan
+
+Copyright (c) 2015-2017 Fred Hutchinson Cancer Research Center
+
+Licensed under the Apache License, Version 2.0: http://www.apache.org/licenses/LICENSE-2.0
+
+case_store.py holds case-level (patient and tumor) genetic testing status,
+spilling it to sqlite once it grows past a memory budget, or persisting it
+with the labels of every record so it can be updated incrementally.
+"""
+import os
+import sqlite3
+import tempfile
+
+
+class CaseStore:
+	""" Mapping of case ID to a dict of gen marker mapped to status with
+	deciding report ID. Cases are held in memory until more than max_cases
+	are held, at which point they are all written to a sqlite file and
+	memory is cleared. Cases updated after a spill return to memory until
+	the next spill, so reads check memory before disk. """
+
+	def __init__(self, max_cases=None, path=None):
+		""" Initializes CaseStore instance.
+		Args:
+			max_cases (int) : number of cases to hold in memory before
+				spilling to disk, or None to never spill
+			path (str) : path to sqlite file to spill to; a temporary file
+				removed on close is used if not given
+		"""
+		self.max_cases = max_cases
+		self.path = path
+		self.memory = {}
+		self.db = None
+		self._temporary = path is None
+
+	def get(self, case, default=None):
+		""" Returns status of case, or default if case has not been stored. """
+		if case in self.memory:
+			return self.memory[case]
+		if self.db is not None:
+			row = self.db.execute(
+				'SELECT status FROM cases WHERE id = ?', (case,)).fetchone()
+			if row is not None:
+				return _decode_status(row[0])
+		return default
+
+	def __getitem__(self, case):
+		status = self.get(case)
+		if status is None:
+			raise KeyError(case)
+		return status
+
+	def __setitem__(self, case, status):
+		self.memory[case] = status
+		if self.max_cases is not None and len(self.memory) > self.max_cases:
+			self.spill()
+
+	def spill(self):
+		""" Writes every case held in memory to disk and clears memory. """
+		if self.db is None:
+			self._connect()
+		with self.db:
+			self.db.executemany(
+				'INSERT OR REPLACE INTO cases (id, status) VALUES (?, ?)',
+				((case, _encode_status(status)) for case, status in self.memory.items()))
+		self.memory = {}
+
+	def clear(self):
+		""" Removes every case, from memory and from a sqlite file kept from
+		an earlier run. """
+		self.memory = {}
+		if self.db is None and self.path is not None and os.path.exists(self.path):
+			self._connect()
+		if self.db is not None:
+			with self.db:
+				self.db.execute('DELETE FROM cases')
+
+	def sorted_items(self):
+		""" Yields (case, status) pairs sorted by case ID. When cases have
+		been spilled, memory is spilled first and cases are streamed from
+		disk in order rather than loaded all at once. """
+		if self.db is None:
+			for case in sorted(self.memory):
+				yield case, self.memory[case]
+			return
+		self.spill()
+		for case, status in self.db.execute(
+				'SELECT id, status FROM cases ORDER BY id'):
+			yield case, _decode_status(status)
+
+	def close(self):
+		""" Closes the sqlite file, removing it if it was temporary. """
+		if self.db is not None:
+			self.db.close()
+			self.db = None
+			if self._temporary:
+				os.remove(self.path)
+				self.path = None
+
+	def _connect(self):
+		""" Opens the sqlite file and creates the cases table. """
+		if self.path is None:
+			handle, self.path = tempfile.mkstemp(suffix='.sqlite', prefix='cases_')
+			os.close(handle)
+		self.db = sqlite3.connect(self.path)
+		self.db.text_factory = str
+		self.db.execute(
+			'CREATE TABLE IF NOT EXISTS cases (id TEXT PRIMARY KEY, status TEXT)')
+
+
+class CaseHistory:
+	""" Persistent case-level state for incremental runs. Stores the labels
+	of every record in input order alongside each case's resolved status.
+	Records added in a later run are appended, or replace the labels of the
+	record with the same ID in place; only the cases they touch are resolved
+	again, by replaying their records in order. """
+
+	def __init__(self, path):
+		""" Initializes CaseHistory instance, creating the sqlite file if needed.
+		Args:
+			path (str) : path to sqlite state file
+		"""
+		self.path = path
+		self.db = sqlite3.connect(path)
+		self.db.text_factory = str
+		with self.db:
+			self.db.execute(
+				'CREATE TABLE IF NOT EXISTS records (seq INTEGER PRIMARY KEY, ' +
+				'id TEXT UNIQUE, case_id TEXT, labels TEXT)')
+			self.db.execute(
+				'CREATE INDEX IF NOT EXISTS records_case ON records (case_id, seq)')
+			self.db.execute(
+				'CREATE TABLE IF NOT EXISTS cases (id TEXT PRIMARY KEY, status TEXT)')
+		self.dirty = set()
+
+	def add(self, case, record, labels):
+		""" Adds or replaces the labels of a record and marks its case for
+		resolution.
+		Args:
+			case (str) : patient ID and tumor ID of record
+			record (str) : record ID
+			labels (list of (str, str, str)) :
+				reported, result and method for each marker
+		"""
+		encoded = '\t'.join('\t'.join(marker_labels) for marker_labels in labels)
+		row = self.db.execute(
+			'SELECT case_id FROM records WHERE id = ?', (record,)).fetchone()
+		if row is None:
+			self.db.execute(
+				'INSERT INTO records (id, case_id, labels) VALUES (?, ?, ?)',
+				(record, case, encoded))
+		else:
+			self.db.execute(
+				'UPDATE records SET case_id = ?, labels = ? WHERE id = ?',
+				(case, encoded, record))
+			# a record moved to another case changes the old case too
+			self.dirty.add(row[0])
+		self.dirty.add(case)
+
+	def resolve(self, update):
+		""" Resolves the status of every case touched since the last call.
+		Args:
+			update (function) : maps (status, record ID, labels) to the
+				status after that record, as run.update_status does
+		"""
+		with self.db:
+			for case in sorted(self.dirty):
+				status = {}
+				for record, labels in self.db.execute(
+						'SELECT id, labels FROM records WHERE case_id = ? ORDER BY seq',
+						(case,)).fetchall():
+					fields = labels.split('\t')
+					status = update(
+						status, record,
+						[tuple(fields[i:i + 3]) for i in range(0, len(fields), 3)])
+				if status:
+					self.db.execute(
+						'INSERT OR REPLACE INTO cases (id, status) VALUES (?, ?)',
+						(case, _encode_status(status)))
+				else:
+					self.db.execute('DELETE FROM cases WHERE id = ?', (case,))
+		self.dirty = set()
+
+	def sorted_items(self):
+		""" Yields (case, status) pairs of every resolved case, sorted by ID. """
+		for case, status in self.db.execute(
+				'SELECT id, status FROM cases ORDER BY id'):
+			yield case, _decode_status(status)
+
+	def close(self):
+		""" Commits and closes the state file. """
+		self.db.commit()
+		self.db.close()
+
+
+def _encode_status(status):
+	""" Flattens gen marker mapped to (status, report ID) into a tab
+	delimited string; none of the values can hold a tab. """
+	return '\t'.join(
+		'\t'.join((marker,) + tuple(values)) for marker, values in status.items())
+
+
+def _decode_status(status):
+	""" Converts a stored status back into gen marker mapped to tuple. """
+	fields = status.split('\t')
+	return dict(
+		(fields[i], (fields[i + 1], fields[i + 2]))
+		for i in range(0, len(fields), 3))
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+
+"""
+author@kathrynegan
+
+Copyright (c) 2015-2017 Fred Hutchinson Cancer Research Center
+
+Licensed under the Apache License, Version 2.0: http://www.apache.org/licenses/LICENSE-2.0
+
+checkpoint.py saves the progress of a run through its input to a sqlite file
+so that an interrupted run can resume where it was: how far the input was
+read, how much output was written and the status of every case so far.
+"""
+import os
+import json
+import sqlite3
+from utils.case_store import _encode_status, _decode_status
+
+EVERY = 10000  # rows resolved between checkpoints
+
+
+class Checkpoint:
+	""" Progress of a run and a snapshot of its case-level status, kept in a
+	sqlite file. Each save is one transaction, so the file always holds the
+	last whole checkpoint. Only cases resolved since the last save are
+	written, and together with the cases already saved they make up the
+	status of every case at the checkpoint. """
+
+	def __init__(self, path, run, every=EVERY):
+		""" Initializes Checkpoint instance, creating the sqlite file if needed.
+		Args:
+			path (str) : path to sqlite checkpoint file
+			run (dict str:str) : input and output files of the run, which a
+				resumed run must share
+			every (int) : rows resolved between checkpoints
+		"""
+		self.path = path
+		self.run = json.dumps(run, sort_keys=True)
+		self.every = every
+		self.db = sqlite3.connect(path)
+		self.db.text_factory = str
+		with self.db:
+			self.db.execute(
+				'CREATE TABLE IF NOT EXISTS progress (key TEXT PRIMARY KEY, value TEXT)')
+			self.db.execute(
+				'CREATE TABLE IF NOT EXISTS cases (id TEXT PRIMARY KEY, status TEXT)')
+		self.rows = 0  # rows resolved since the last save
+		self.touched = set()  # cases resolved since the last save
+
+	def load(self):
+		""" Returns the progress saved by the last checkpoint, or None if
+		nothing has been saved. Raises an error if it was saved by a run with
+		other files. """
+		progress = dict(self.db.execute('SELECT key, value FROM progress'))
+		if not progress:
+			return None
+		if progress.pop('run') != self.run:
+			raise IOError(
+				'Checkpoint {} was saved by a run with other files than {}. '.format(
+					self.path, self.run) +
+				'Please resume with the same files or start without --resume.\n')
+		return dict((key, json.loads(value)) for key, value in progress.items())
+
+	def cases(self):
+		""" Yields (case, status) pairs of every case saved. """
+		for case, status in self.db.execute('SELECT id, status FROM cases'):
+			yield case, _decode_status(status)
+
+	def reset(self):
+		""" Removes any saved progress and cases, to start a new run. """
+		with self.db:
+			self.db.execute('DELETE FROM progress')
+			self.db.execute('DELETE FROM cases')
+		self.rows = 0
+		self.touched = set()
+
+	def add(self, cases):
+		""" Notes the cases of rows just resolved.
+		Args:
+			cases (list of str) : case ID of each row
+		Returns:
+			bool : True if a checkpoint is due
+		"""
+		self.rows += len(cases)
+		self.touched.update(cases)
+		return self.rows >= self.every
+
+	def save(self, progress, statuses):
+		""" Saves progress and the status of cases in one transaction.
+		Args:
+			progress (dict str:object) : JSON serializable progress of the run
+			statuses (iterable of (str, dict)) : case ID and status of every
+				case resolved since the last save
+		"""
+		items = [(key, json.dumps(value)) for key, value in progress.items()]
+		with self.db:
+			self.db.executemany(
+				'INSERT OR REPLACE INTO progress (key, value) VALUES (?, ?)',
+				items + [('run', self.run)])
+			self.db.executemany(
+				'INSERT OR REPLACE INTO cases (id, status) VALUES (?, ?)',
+				((case, _encode_status(status)) for case, status in statuses))
+		self.rows = 0
+		self.touched = set()
+
+	def close(self):
+		""" Closes the sqlite file. """
+		if self.db is not None:
+			self.db.close()
+			self.db = None
+
+	def remove(self):
+		""" Closes and removes the sqlite file, once the run is complete. """
+		self.close()
+		os.remove(self.path)
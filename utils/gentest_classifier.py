@@ -14,28 +14,83 @@ make_arrays.py
 decoder.py
 """
 import os
+import threading
 import numpy as np
-from scipy.sparse import dok_matrix
-from sklearn.externals import joblib
+from scipy.sparse import csr_matrix
+from utils.linear_model import LinearModel, read_mapping, load_estimator
+
+NOT_REPORTED = ('Not Reported', 'N/A', 'N/A')  # labels of vectors without a keyword
+
+# models the classification cascade consults: whether results are reported,
+# then the result and test method of reported vectors
+ALGORITHMS = ('svm_reported', 'positive', 'method')
 
 
 class GenTestClassifier:
 
-	def __init__(self, model_dir):
-		""" Initializes GenTestClassifier instance. """
-		self.algorithms = {}
-		for algorithm in os.listdir(model_dir):
-			model = Model()
-			with open(os.path.join(model_dir, algorithm, 'features.txt'), 'r') as f:
-				for line in f.readlines():
-					feature, index = line.split()
-					index = int(index)
-					model.mapping[feature] = index
-					model.num_features = max(model.num_features, index + 1)
+	def __init__(self, model_dir, native=False, warm_up=False):
+		""" Initializes GenTestClassifier instance. Models are loaded the first
+		time the cascade needs them, so algorithms no vector reaches are never
+		read. Algorithms exported to the compact format (see
+		utils/linear_model.py) are memory mapped; others are read from
+		features.txt and model.pkl.
+		Args:
+			model_dir (str) : path to model directory
+			native (bool) : score vectors directly from the linear weights
+				instead of building sparse matrices for predict
+			warm_up (bool) : load every model in ALGORITHMS now (see warm_up)
+		"""
+		self.model_dir = model_dir
+		self.native = native
+		self.algorithms = {}  # algorithm mapped to its loaded Model
+		self.lock = threading.Lock()
+		if warm_up:
+			self.warm_up()
+
+	def warm_up(self):
+		""" Loads every model the cascade uses, so the first classifications
+		of a long-running service do not pay for loading them. """
+		for algorithm in ALGORITHMS:
+			self._model(algorithm)
+
+	def _model(self, algorithm):
+		""" Returns the model of an algorithm, loading it on first use.
+		Args:
+			algorithm (str) : name of algorithm
+		Returns:
+			Model : loaded model
+		"""
+		model = self.algorithms.get(algorithm)
+		if model is None:
+			with self.lock:
+				model = self.algorithms.get(algorithm)
+				if model is None:
+					model = self._load(algorithm)
+					self.algorithms[algorithm] = model
+		return model
+
+	def _load(self, algorithm):
+		""" Reads the model of an algorithm from its folder in model_dir.
+		Args:
+			algorithm (str) : name of algorithm
+		Returns:
+			Model : loaded model
+		"""
+		directory = os.path.join(self.model_dir, algorithm)
+		if not os.path.isdir(directory):
+			raise IOError('model not found: {}'.format(directory))
+		model = Model()
+		if LinearModel.exists(directory):
+			model.model = LinearModel.load(directory)
+			model.num_features = model.model.num_features
+		else:
+			model.mapping, model.num_features = read_mapping(directory)
 			# joblib is json for large, sparse numpy arrays
-			model.model = joblib.load(
-				os.path.join(model_dir, algorithm, 'model.pkl'))
-			self.algorithms[algorithm] = model
+			model.model = load_estimator(directory)
+			if self.native:
+				model.model = LinearModel.from_estimator(model.model, model.mapping)
+				model.num_features = model.model.num_features
+		return model
 
 	def classify(self, vector):
 		""" Returns the label for each of results reported,
@@ -52,37 +107,63 @@ class GenTestClassifier:
 				'N/A' if no results were reported or if the results were ambiguous
 			method (str) : the test method that was used to obtain results (e.g. FISH)
 		"""
-		reported, result, method = 'Not Reported', 'N/A', 'N/A'
-		if 'NO_KEYWORD_IN_TEXT' in vector:
-			return reported, result, method
-		if self._classify('svm_reported', vector) != 'Reported':
-			return reported, result, method
-		reported = 'Results Reported'
-		result = self._classify('positive', vector)
-		method = self._classify('method', vector)
-		return reported, result, method
-
-	def _classify(self, algorithm, vector):
-		""" Returns the label for this vector given the algorithm.
+		return self.classify_batch([vector])[0]
+
+	def classify_batch(self, vectors):
+		""" Returns the labels of classify for each of many vectors. Each model
+		predicts once over a single matrix of the vectors routed to it; only
+		vectors classified as reported are passed to the positive and method
+		models.
+		Args:
+			vectors (list of list of str) : vectors of features as strings
+		Returns:
+			list of (str, str, str) : reported, result and method for each vector
+		"""
+		labels = [NOT_REPORTED] * len(vectors)
+		keyword = [
+			i for i, vector in enumerate(vectors) if 'NO_KEYWORD_IN_TEXT' not in vector]
+		if not keyword:
+			return labels
+		reported = self._classify_batch(
+			'svm_reported', [vectors[i] for i in keyword])
+		keyword = [i for i, label in zip(keyword, reported) if label == 'Reported']
+		if not keyword:
+			return labels
+		routed = [vectors[i] for i in keyword]
+		results = self._classify_batch('positive', routed)
+		methods = self._classify_batch('method', routed)
+		for i, result, method in zip(keyword, results, methods):
+			labels[i] = ('Results Reported', result, method)
+		return labels
+
+	def _classify_batch(self, algorithm, vectors):
+		""" Returns the label for each vector given the algorithm.
 		Args:
 			algorithm (str) : name of algorithm
-			vector (list of str) : list of features as strings in vector
+			vectors (list of list of str) : vectors of features as strings
 		Returns:
-			str : instance label
+			list of str : instance label for each vector
 		"""
-		# instantiate empty numinstances x numfeatures matrix
-		model = self.algorithms[algorithm]
-		matrix = dok_matrix((1, model.num_features), dtype=np.float64)
-		# populate matrix with binary values representing features in instance
-		for feature in vector:
-			try:
-				matrix[0, model.mapping[feature]] = 1
-			except KeyError:
-				continue
-		matrix.tocsc()
-		output = model.model.predict(matrix)[0]
-		output = self._translate_output(algorithm == 'method', output)
-		return output
+		model = self._model(algorithm)
+		is_method = algorithm == 'method'
+		if self.native:
+			return [
+				self._translate_output(is_method, output)
+				for output in model.model.predict_vectors(vectors)]
+		# binary numinstances x numfeatures matrix; features repeated within a
+		# vector are set once, features unknown to the model are dropped
+		indptr = [0]
+		indices = []
+		for vector in vectors:
+			indices.extend(model.columns(vector))
+			indptr.append(len(indices))
+		matrix = csr_matrix(
+			(np.ones(len(indices)), np.array(indices, dtype=np.int32),
+				np.array(indptr, dtype=np.int32)),
+			shape=(len(vectors), model.num_features))
+		return [
+			self._translate_output(is_method, output)
+			for output in model.model.predict(matrix)]
 
 	def _translate_output(self, is_method, output):
 		""" Converts the output of the SVM to a meaningful label.
@@ -119,6 +200,18 @@ class Model:
 		self.mapping = {}
 		self.num_features = 0
 
+	def columns(self, vector):
+		""" Returns the sorted, unique columns of the known features in vector.
+		Args:
+			vector (list of str) : list of features as strings in vector
+		Returns:
+			list of int : column indices
+		"""
+		if isinstance(self.model, LinearModel):
+			return self.model.columns(vector)
+		mapping = self.mapping
+		return sorted(set(mapping[feature] for feature in vector if feature in mapping))
+
 	@property
 	def model(self):
 		return self.model
@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+
+"""
+author@kathrynegan
+
+Copyright (c) 2015-2017 Fred Hutchinson Cancer Research Center
+
+Licensed under the Apache License, Version 2.0: http://www.apache.org/licenses/LICENSE-2.0
+
+linear_model.py stores a linear SVM as plain numpy arrays that load with
+memory mapping, so several processes share one copy of the model pages.
+
+Usage: python -m utils.linear_model [--check] <model directory>
+Exports every algorithm folder in the model directory (features.txt and
+model.pkl) to the compact format alongside the original files. With --check,
+also verifies that native scoring matches sklearn predict on synthetic
+binary vectors and exits with an error if any label differs.
+"""
+import os
+import sys
+import random
+import numpy as np
+
+
+class LinearModel:
+	""" Coefficients, intercepts and labels of a linear SVM with its feature
+	vocabulary. The vocabulary is a sorted array of feature strings and the
+	coefficient columns are stored in vocabulary order, so a feature's
+	column is its position in the sorted vocabulary. """
+
+	FILES = ('coef', 'intercept', 'classes', 'vocabulary')
+
+	def __init__(self, coef, intercept, classes, vocabulary):
+		""" Initializes LinearModel instance.
+		Args:
+			coef (numpy array) : num classes (1 if binary) x num features
+			intercept (numpy array) : one intercept per row of coef
+			classes (numpy array) : labels output by the SVM
+			vocabulary (numpy array) : sorted feature strings, one per column
+		"""
+		self.coef = coef
+		self.intercept = intercept
+		self.classes = classes
+		self.vocabulary = vocabulary
+		self.num_features = len(vocabulary)
+
+	@staticmethod
+	def exists(directory):
+		""" Returns whether a compact model has been exported to directory. """
+		return all(
+			os.path.exists(os.path.join(directory, name + '.npy'))
+			for name in LinearModel.FILES)
+
+	@classmethod
+	def load(cls, directory, mmap=True):
+		""" Loads a compact model from directory.
+		Args:
+			directory (str) : path to algorithm folder
+			mmap (bool) : memory map the arrays rather than reading them
+		Returns:
+			LinearModel : loaded model
+		"""
+		mode = 'r' if mmap else None
+		arrays = [
+			np.load(os.path.join(directory, name + '.npy'), mmap_mode=mode)
+			for name in cls.FILES]
+		return cls(*arrays)
+
+	@classmethod
+	def from_estimator(cls, estimator, mapping):
+		""" Builds a compact model from a fitted linear sklearn classifier.
+		Args:
+			estimator (sklearn classifier) : fitted model with coef_,
+				intercept_ and classes_ whose prediction is the argmax (or
+				sign, if binary) of its decision function
+			mapping (dict str:int) : feature mapped to column index
+		Returns:
+			LinearModel : model with columns in sorted feature order
+		"""
+		if not hasattr(estimator, 'coef_') or (
+				hasattr(estimator, 'support_') and len(estimator.classes_) > 2):
+			raise ValueError(
+				'Only linear one-vs-rest or binary models can be exported.')
+		features = sorted(mapping)
+		vocabulary = np.array(features, dtype=np.bytes_)
+		columns = [mapping[feature] for feature in features]
+		coef = estimator.coef_
+		if hasattr(coef, 'toarray'):
+			coef = coef.toarray()
+		coef = np.ascontiguousarray(np.asarray(coef, dtype=np.float64)[:, columns])
+		intercept = np.asarray(estimator.intercept_, dtype=np.float64).ravel()
+		return cls(coef, intercept, np.asarray(estimator.classes_), vocabulary)
+
+	def save(self, directory):
+		""" Saves the model arrays to directory as .npy files. """
+		for name in self.FILES:
+			np.save(os.path.join(directory, name + '.npy'), getattr(self, name))
+
+	def columns(self, vector):
+		""" Returns the sorted, unique columns of the features in vector that
+		are in the vocabulary.
+		Args:
+			vector (list of str) : list of features as strings in vector
+		Returns:
+			numpy array : column indices
+		"""
+		if not vector or not self.num_features:
+			return np.zeros(0, dtype=np.int32)
+		features = np.unique(np.array(vector, dtype=np.bytes_))
+		positions = np.searchsorted(self.vocabulary, features)
+		positions[positions == self.num_features] = 0
+		return positions[self.vocabulary[positions] == features].astype(np.int32)
+
+	def predict(self, matrix):
+		""" Returns the label for each row of a binary feature matrix, as the
+		sklearn linear classifiers do.
+		Args:
+			matrix (scipy sparse matrix) : num instances x num features
+		Returns:
+			numpy array : label for each row
+		"""
+		scores = np.asarray(matrix.dot(self.coef.T)) + self.intercept
+		if scores.shape[1] == 1:
+			indices = (scores.ravel() > 0).astype(np.int64)
+		else:
+			indices = scores.argmax(axis=1)
+		return self.classes[indices]
+
+	def decision(self, vector):
+		""" Returns the decision value of a vector without building a matrix.
+		Every feature value is 1, so this is the sum of the coefficient columns
+		of the active features plus the intercept.
+		Args:
+			vector (list of str) : list of features as strings in vector
+		Returns:
+			numpy array : one decision value per row of coef
+		"""
+		return self.coef[:, self.columns(vector)].sum(axis=1) + self.intercept
+
+	def predict_vectors(self, vectors):
+		""" Returns the label for each vector by native scoring, as predict
+		would for the equivalent binary matrix.
+		Args:
+			vectors (list of list of str) : vectors of features as strings
+		Returns:
+			list : label for each vector
+		"""
+		labels = []
+		for vector in vectors:
+			scores = self.decision(vector)
+			index = int(scores[0] > 0) if len(scores) == 1 else scores.argmax()
+			labels.append(self.classes[index])
+		return labels
+
+
+def read_mapping(directory):
+	""" Reads the feature mapping of an algorithm folder.
+	Args:
+		directory (str) : path to algorithm folder
+	Returns:
+		mapping (dict str:int) : feature mapped to column index
+		num_features (int) : number of columns in the model
+	"""
+	mapping = {}
+	num_features = 0
+	with open(os.path.join(directory, 'features.txt'), 'r') as f:
+		for line in f.readlines():
+			feature, index = line.split()
+			index = int(index)
+			mapping[feature] = index
+			num_features = max(num_features, index + 1)
+	return mapping, num_features
+
+
+def load_estimator(directory):
+	""" Loads the pickled sklearn model of an algorithm folder. Imported
+	here so loading compact models never pays for importing sklearn. """
+	try:
+		from sklearn.externals import joblib
+	except ImportError:
+		import joblib
+	return joblib.load(os.path.join(directory, 'model.pkl'))
+
+
+def check_parity(estimator, mapping, num_vectors=1000, seed=0):
+	""" Compares native scoring of an estimator's compact model against the
+	estimator's own predict on random binary vectors. Vectors mix known
+	features, repeated features and features unknown to the model.
+	Args:
+		estimator (sklearn classifier) : fitted linear model
+		mapping (dict str:int) : feature mapped to column index
+		num_vectors (int) : number of synthetic vectors to check
+		seed (int) : random seed
+	Returns:
+		mismatches (int) : number of vectors whose labels differ
+		max_difference (float) : largest absolute decision value difference
+	"""
+	from scipy.sparse import csr_matrix
+	model = LinearModel.from_estimator(estimator, mapping)
+	num_features = estimator.coef_.shape[1]
+	features = sorted(mapping)
+	generator = random.Random(seed)
+	vectors = []
+	for i in range(num_vectors):
+		size = generator.randint(0, min(len(features), 200))
+		vector = generator.sample(features, size)
+		vector += vector[:generator.randint(0, 3)]
+		vector += ['UNKNOWN_FEATURE_{}'.format(generator.randint(0, 9))]
+		vectors.append(vector)
+	indptr = [0]
+	indices = []
+	for vector in vectors:
+		indices.extend(sorted(set(
+			mapping[feature] for feature in vector if feature in mapping)))
+		indptr.append(len(indices))
+	matrix = csr_matrix(
+		(np.ones(len(indices)), np.array(indices, dtype=np.int32),
+			np.array(indptr, dtype=np.int32)),
+		shape=(len(vectors), num_features))
+	expected = estimator.predict(matrix)
+	decisions = np.asarray(estimator.decision_function(matrix)).reshape(len(vectors), -1)
+	native = model.predict_vectors(vectors)
+	mismatches = sum(1 for a, b in zip(expected, native) if a != b)
+	max_difference = max([0.0] + [
+		float(np.abs(model.decision(vector) - decision).max())
+		for vector, decision in zip(vectors, decisions)])
+	return mismatches, max_difference
+
+
+def export_models(model_dir, check=False):
+	""" Exports every algorithm folder in model_dir to the compact format.
+	Args:
+		model_dir (str) : path to model directory
+		check (bool) : check native scoring against sklearn for each model
+	Returns:
+		bool : False if any checked model's labels differ, True otherwise
+	"""
+	passed = True
+	for algorithm in sorted(os.listdir(model_dir)):
+		directory = os.path.join(model_dir, algorithm)
+		mapping, num_features = read_mapping(directory)
+		estimator = load_estimator(directory)
+		model = LinearModel.from_estimator(estimator, mapping)
+		model.save(directory)
+		sys.stderr.write('Exported {} ({} features)\n'.format(
+			algorithm, model.num_features))
+		if check:
+			mismatches, max_difference = check_parity(estimator, mapping)
+			passed = passed and not mismatches
+			sys.stderr.write(
+				'Parity {}: {} label mismatches, max decision difference {:.2e}\n'.format(
+					algorithm, mismatches, max_difference))
+	return passed
+
+
+if __name__ == "__main__":
+	args = sys.argv[1:]
+	check = '--check' in args
+	args = [arg for arg in args if arg != '--check']
+	if not args:
+		raise IndexError('Provide path to model directory as first argument.')
+	if not export_models(args[0], check):
+		sys.exit(1)
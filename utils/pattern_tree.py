@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+
+"""
+author@kathrynegan
+
+Copyright (c) 2015-2017 Fred Hutchinson Cancer Research Center
+
+Licensed under the Apache License, Version 2.0: http://www.apache.org/licenses/LICENSE-2.0
+
+pattern_tree.py applies an ordered family of regex substitutions to a report
+while scanning the text far fewer times than one re.sub per pattern.
+"""
+import re
+
+
+class PatternTree:
+	""" Binary tree of combined alternations over an ordered list of
+	(regex, replacement) substitutions. Each inner node holds one regex that
+	is the alternation of every pattern beneath it. If that regex finds no
+	match anywhere in the text, none of its patterns can change the text, so
+	the whole subtree is skipped. Patterns that can match are still applied
+	one at a time in list order, so the output is identical to running every
+	re.sub in sequence. """
+
+	def __init__(self, substitutions, max_line=None):
+		""" Initializes PatternTree instance by compiling the combined
+		alternation for every inner node.
+		Args:
+			substitutions (list of (regex, str)) :
+				compiled patterns mapped to their replacement string, in the
+				order they would be applied. All patterns must share flags.
+			max_line (int) : if given, every pattern only matches whole lines
+				of at most max_line characters, so longer lines are skipped
+		"""
+		flags = set(pattern.flags for pattern, subin in substitutions)
+		if len(flags) > 1:
+			raise ValueError('Patterns in a PatternTree must share flags.')
+		self.flags = flags.pop() if flags else 0
+		self.substitutions = substitutions
+		self.max_line = max_line
+		self.root = self._build(0, len(substitutions)) if substitutions else None
+
+	def _build(self, start, end):
+		""" Recursively builds the node covering substitutions[start:end].
+		Args:
+			start (int) : index of first substitution in node
+			end (int) : index after last substitution in node
+		Returns:
+			_Node : node covering the given substitutions
+		"""
+		if end - start == 1:
+			pattern, subin = self.substitutions[start]
+			return _Node(pattern, subin)
+		# capture groups are dropped; python 2 allows only 100 groups per regex.
+		# branches are joined bare so sre can factor out the shared cushion
+		combined = '|'.join(
+			non_capturing(pattern.pattern)
+			for pattern, subin in self.substitutions[start:end])
+		middle = (start + end) // 2
+		return _Node(
+			re.compile(combined, self.flags), None,
+			(self._build(start, middle), self._build(middle, end)))
+
+	def sub(self, text):
+		""" Applies every substitution in order to text.
+		Args:
+			text (str) : text to substitute
+		Returns:
+			str : substituted text
+		"""
+		if self.root is None:
+			return text
+		if self.max_line is not None:
+			lines = text.split('\n')
+			if len(max(lines, key=len)) > self.max_line:
+				return self._sub_lines(lines)
+		if not self.root.matches(text):
+			return text
+		return self._apply(self.root, text)
+
+	def _sub_lines(self, lines):
+		""" Applies every substitution to each run of lines no longer than
+		max_line, leaving longer lines as they are. Each match is one whole
+		line, so this gives the same text as substituting all lines at once.
+		Args:
+			lines (list of str) : lines of text to substitute
+		Returns:
+			str : substituted text
+		"""
+		substituted = []
+		short = []
+		for line in lines + [None]:
+			if line is not None and len(line) <= self.max_line:
+				short.append(line)
+				continue
+			if short:
+				text = '\n'.join(short)
+				if self.root.matches(text):
+					text = self._apply(self.root, text)
+				substituted.append(text)
+				short = []
+			if line is not None:
+				substituted.append(line)
+		return '\n'.join(substituted)
+
+	def nodes(self):
+		""" Yields every node of the tree, parents before their children.
+		Yields:
+			_Node : node of tree
+		"""
+		pending = [self.root] if self.root is not None else []
+		while pending:
+			node = pending.pop()
+			yield node
+			if node.children is not None:
+				pending.extend(reversed(node.children))
+
+	def _apply(self, node, text):
+		""" Applies the substitutions of a node already known to match text.
+		Args:
+			node (_Node) : node to apply
+			text (str) : text to substitute
+		Returns:
+			str : substituted text
+		"""
+		if node.children is None:
+			return node.pattern.sub(node.subin, text)
+		left, right = node.children
+		if left.matches(text):
+			text = self._apply(left, text)
+			if right.matches(text):
+				text = self._apply(right, text)
+		else:
+			# text is unchanged and the node matched, so the right side must match
+			text = self._apply(right, text)
+		return text
+
+
+class _Node:
+	""" Tiny class to store a node of a PatternTree. """
+
+	def __init__(self, pattern, subin, children=None):
+		self.pattern = pattern
+		self.subin = subin
+		self.children = children
+
+	def matches(self, text):
+		""" Returns whether any pattern under this node may match text. A leaf
+		always reports True; its re.sub is a no-op when nothing matches. """
+		if self.children is None:
+			return True
+		return self.pattern.search(text) is not None
+
+
+def non_capturing(pattern):
+	""" Returns pattern with every capturing group made non-capturing.
+	Escapes and character classes are left untouched.
+	Args:
+		pattern (str) : regex pattern
+	Returns:
+		str : equivalent pattern without capturing groups
+	"""
+	converted = []
+	index = 0
+	in_class = False
+	while index < len(pattern):
+		char = pattern[index]
+		if char == '\\':
+			converted.append(pattern[index:index + 2])
+			index += 2
+			continue
+		if in_class:
+			in_class = char != ']'
+		elif char == '[':
+			in_class = True
+			# a leading ']' (after an optional '^') is a literal, not the end
+			end = index + 1
+			if pattern[end:end + 1] == '^':
+				end += 1
+			if pattern[end:end + 1] == ']':
+				end += 1
+			converted.append(pattern[index:end])
+			index = end
+			continue
+		elif char == '(' and pattern[index + 1:index + 2] != '?':
+			char = '(?:'
+		converted.append(char)
+		index += 1
+	return ''.join(converted)
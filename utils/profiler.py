@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+
+"""
+author@kathrynegan
+
+Copyright (c) 2015-2017 Fred Hutchinson Cancer Research Center
+
+Licensed under the Apache License, Version 2.0: http://www.apache.org/licenses/LICENSE-2.0
+
+profiler.py collects opt-in timing for the vectorizer pipeline: time spent in
+each stage, calls, hits and time of every regex, the slowest documents, and
+a live records/sec readout. Nothing is timed unless a Vectorizer is
+instrumented with a Profiler (see Vectorizer.instrument).
+"""
+import csv
+import sys
+import json
+import time
+import heapq
+
+PATTERN_WIDTH = 200  # characters of regex source kept in reports
+
+
+class Profiler:
+	""" Accumulates stage, pattern and document timings of instrumented
+	vectorizers and counts records as they are processed. """
+
+	def __init__(self, slowest=20, interval=5.0, stream=sys.stderr):
+		""" Initializes Profiler instance.
+		Args:
+			slowest (int) : number of slowest patterns and documents reported
+			interval (float) : seconds between live records/sec readouts
+			stream (file) : stream to write live readouts to
+		"""
+		self.slowest = slowest
+		self.interval = interval
+		self.stream = stream
+		self.stages = {}  # stage name mapped to [calls, seconds]
+		self.patterns = {}  # pattern label mapped to [source, calls, hits, seconds]
+		self.documents = []  # min-heap of (seconds, accession, characters)
+		self.records = 0
+		self.start = time.time()
+		self.last_readout = self.start
+
+	def time_stage(self, name, function):
+		""" Returns function wrapped to add its run time to a stage.
+		Args:
+			name (str) : name of stage
+			function (function) : stage to time
+		Returns:
+			function : timed function
+		"""
+		totals = self.stages.setdefault(name, [0, 0.0])
+
+		def timed(*args, **kwargs):
+			start = time.time()
+			try:
+				return function(*args, **kwargs)
+			finally:
+				totals[0] += 1
+				totals[1] += time.time() - start
+		return timed
+
+	def time_document(self, function):
+		""" Returns a make_vectors style function wrapped to keep the slowest
+		documents by total run time.
+		Args:
+			function (function) : takes report text and accession number first
+		Returns:
+			function : timed function
+		"""
+		def timed(text, accession, *args, **kwargs):
+			start = time.time()
+			try:
+				return function(text, accession, *args, **kwargs)
+			finally:
+				entry = (time.time() - start, accession, len(text))
+				if len(self.documents) < self.slowest:
+					heapq.heappush(self.documents, entry)
+				elif entry > self.documents[0]:
+					heapq.heapreplace(self.documents, entry)
+		return timed
+
+	def wrap(self, pattern, label):
+		""" Returns a compiled regex wrapped to count its calls, hits and time.
+		Args:
+			pattern (regex or TimedPattern) : compiled pattern
+			label (str) : unique name of pattern
+		Returns:
+			TimedPattern : pattern that records into this profiler
+		"""
+		if isinstance(pattern, TimedPattern):
+			return pattern
+		totals = self.patterns.setdefault(
+			label, [pattern.pattern[:PATTERN_WIDTH], 0, 0, 0.0])
+		return TimedPattern(pattern, totals)
+
+	def record(self):
+		""" Counts a processed record, writing the records/sec rate every
+		interval seconds. """
+		self.records += 1
+		now = time.time()
+		if now - self.last_readout >= self.interval:
+			self.last_readout = now
+			self.stream.write('{} records processed, {:.1f} records/sec\n'.format(
+				self.records, self.records / max(now - self.start, 1e-9)))
+
+	def summary(self):
+		""" Returns every collected measure.
+		Returns:
+			dict : run totals, stages, patterns sorted slowest first, the
+				slowest patterns and the slowest documents
+		"""
+		seconds = time.time() - self.start
+		stages = [
+			{'stage': name, 'calls': calls, 'seconds': total,
+				'mean_ms': total * 1000 / max(calls, 1)}
+			for name, (calls, total) in self.stages.items()]
+		stages.sort(key=lambda stage: -stage['seconds'])
+		patterns = [
+			{'pattern': label, 'source': source, 'calls': calls, 'hits': hits,
+				'seconds': total}
+			for label, (source, calls, hits, total) in self.patterns.items()]
+		patterns.sort(key=lambda pattern: -pattern['seconds'])
+		documents = [
+			{'accession': accession, 'characters': characters, 'seconds': total}
+			for total, accession, characters in sorted(self.documents, reverse=True)]
+		return {
+			'records': self.records,
+			'seconds': seconds,
+			'records_per_second': self.records / max(seconds, 1e-9),
+			'stages': stages,
+			'patterns': patterns,
+			'slowest_patterns': patterns[:self.slowest],
+			'slowest_documents': documents}
+
+	def write(self, path):
+		""" Writes the summary to a JSON file, or to a CSV file with one row
+		per run, stage, pattern and slow document if path ends in .csv.
+		Args:
+			path (str) : path to output file
+		"""
+		summary = self.summary()
+		with open(path, 'w') as f:
+			if not path.lower().endswith('.csv'):
+				json.dump(summary, f, indent=2)
+				return
+			writer = csv.writer(f, lineterminator='\n')
+			writer.writerow(['kind', 'name', 'calls', 'hits', 'seconds', 'detail'])
+			writer.writerow([
+				'run', 'records', summary['records'], '', summary['seconds'],
+				'{:.2f} records/sec'.format(summary['records_per_second'])])
+			for stage in summary['stages']:
+				writer.writerow([
+					'stage', stage['stage'], stage['calls'], '', stage['seconds'], ''])
+			for pattern in summary['patterns']:
+				writer.writerow([
+					'pattern', pattern['pattern'], pattern['calls'], pattern['hits'],
+					pattern['seconds'], pattern['source']])
+			for document in summary['slowest_documents']:
+				writer.writerow([
+					'document', document['accession'], 1, '', document['seconds'],
+					'{} characters'.format(document['characters'])])
+
+
+class TimedPattern:
+	""" Compiled regex proxy recording calls, hits (matches found) and time
+	of the methods the vectorizer uses into a shared totals list of
+	[source, calls, hits, seconds]. """
+
+	def __init__(self, pattern, totals):
+		self.compiled = pattern
+		self.totals = totals
+		self.pattern = pattern.pattern
+		self.flags = pattern.flags
+
+	def search(self, text):
+		start = time.time()
+		match = self.compiled.search(text)
+		self._add(start, match is not None)
+		return match
+
+	def sub(self, repl, text):
+		start = time.time()
+		text, hits = self.compiled.subn(repl, text)
+		self._add(start, hits)
+		return text
+
+	def finditer(self, text):
+		start = time.time()
+		matches = list(self.compiled.finditer(text))
+		self._add(start, len(matches))
+		return iter(matches)
+
+	def _add(self, start, hits):
+		totals = self.totals
+		totals[1] += 1
+		totals[2] += hits
+		totals[3] += time.time() - start
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+
+"""
+author@kathrynegan
+
+Copyright (c) 2015-2017 Fred Hutchinson Cancer Research Center
+
+Licensed under the Apache License, Version 2.0: http://www.apache.org/licenses/LICENSE-2.0
+
+readers.py holds the input layer for tab delimited report files. Subsets of
+patients, records and skipped cases are applied as rows are read: a line
+outside them is dropped by reading only its ID fields, before csv parses it
+and before its report text is copied out of the line. Reading can stop at a
+row and resume from there later.
+"""
+import os
+import csv
+
+
+class Subsets:
+	""" Patients and records to keep and patient/tumor cases to skip, each
+	read from a file of whitespace separated IDs. A subset without a file
+	keeps every row. """
+
+	def __init__(self, patients=None, records=None, skip=None):
+		""" Initializes Subsets instance.
+		Args:
+			patients (str) : path to file of patient IDs to keep, or None
+			records (str) : path to file of record IDs to keep, or None
+			skip (str) : path to file of cases (patient ID and tumor record
+				joined by '_') to skip, or None
+		"""
+		self.files = [records, patients, skip]
+		self.patients = _read_ids(patients)
+		self.records = _read_ids(records)
+		self.skip = _read_ids(skip)
+
+	def __nonzero__(self):
+		return bool(self.patients or self.records or self.skip)
+
+	__bool__ = __nonzero__
+
+	def flag(self):
+		""" Returns the names of the subset files, without extension, to mark
+		output files with, or 'all' if no subset is used. """
+		flag = ''.join(
+			'_' + os.path.splitext(os.path.basename(file))[0]
+			for file in self.files if file)
+		return flag or 'all'
+
+	def excludes(self, patient, record, tumor):
+		""" Returns whether a row is outside the subsets.
+		Args:
+			patient (str) : patient ID of row
+			record (str) : record ID of row
+			tumor (str) : tumor record of row
+		Returns:
+			bool : True if the row is not to be processed
+		"""
+		if self.patients and patient not in self.patients:
+			return True
+		if self.records and record not in self.records:
+			return True
+		if self.skip and '{}_{}'.format(patient, tumor) in self.skip:
+			return True
+		return False
+
+
+class SubsetReader:
+	""" Reads rows of a tab delimited file like csv.reader, leaving out rows
+	outside a Subsets once filter is called. When csv is about to start a
+	row, a line with no quotes and one field per header is a whole row, so
+	its ID fields are sliced out at their tab positions and the line is
+	dropped if excluded. Any other line is parsed by csv and its row filtered
+	after, so the rows read are the same as filtering every parsed row. """
+
+	def __init__(self, fin):
+		""" Initializes SubsetReader instance.
+		Args:
+			fin (file) : tab delimited file opened for reading
+		"""
+		self.fin = fin
+		self.subsets = None
+		self.line_num = 0  # lines read, skipped or not, as csv.reader counts
+		self.offset = 0  # bytes read, at a row boundary whenever next returns
+		self.skipped = 0
+		self.starting = False  # whether csv is starting a row
+		self.reader = csv.reader(self._lines(fin), delimiter='\t')
+
+	def filter(self, subsets, patient, record, tumor, row_length):
+		""" Leaves out rows outside subsets from here on.
+		Args:
+			subsets (Subsets) : subsets to keep rows of
+			patient (int) : position of patient ID field
+			record (int) : position of record ID field
+			tumor (int) : position of tumor record field
+			row_length (int) : number of fields in headers
+		"""
+		if subsets:
+			self.subsets = subsets
+			self.columns = (patient, record, tumor)
+			self.row_length = row_length
+
+	def seek(self, offset, line_num, skipped=0):
+		""" Continues reading from a row of the same file, as saved from
+		offset, line_num and skipped when an earlier reader was between rows.
+		Args:
+			offset (int) : bytes read before the row
+			line_num (int) : lines read before the row
+			skipped (int) : rows left out before the row
+		"""
+		self.fin.seek(offset)
+		self.offset = offset
+		self.line_num = line_num
+		self.skipped = skipped
+
+	def __iter__(self):
+		return self
+
+	def next(self):
+		while True:
+			self.starting = True
+			row = next(self.reader)
+			self.starting = False
+			if self.subsets is None or len(row) != self.row_length:
+				return row
+			if not self.subsets.excludes(*[row[column] for column in self.columns]):
+				return row
+			self.skipped += 1
+
+	__next__ = next
+
+	def _lines(self, fin):
+		""" Yields lines of fin to csv, dropping whole excluded rows. """
+		for line in fin:
+			self.line_num += 1
+			self.offset += len(line)
+			if self.starting and self.subsets is not None and self._excludes(line):
+				self.skipped += 1
+				continue
+			self.starting = False
+			yield line
+
+	def _excludes(self, line):
+		""" Returns whether line is a whole row outside the subsets, reading
+		only its ID fields; lines csv could parse otherwise than by splitting
+		on tabs are left to csv. """
+		if '"' in line or line.count('\t') != self.row_length - 1:
+			return False
+		return self.subsets.excludes(*[_field(line, column) for column in self.columns])
+
+
+def _field(line, column):
+	""" Returns field number column of a line with no quotes, without
+	splitting the rest of the line. """
+	start = 0
+	for i in range(column):
+		start = line.index('\t', start) + 1
+	end = line.find('\t', start)
+	if end < 0:
+		end = len(line)
+		while end > start and line[end - 1] in '\r\n':
+			end -= 1
+	return line[start:end]
+
+
+def _read_ids(file):
+	""" Returns the set of whitespace separated IDs in file, or an empty set
+	if no file is given. """
+	if not file:
+		return set()
+	with open(file, 'r') as fin:
+		return set(fin.read().split())
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+
+"""
+author@kathrynegan
+
+Copyright (c) 2015-2017 Fred Hutchinson Cancer Research Center
+
+Licensed under the Apache License, Version 2.0: http://www.apache.org/licenses/LICENSE-2.0
+
+result_cache.py persists classification labels across runs, keyed on the
+content of a report, so re-submitted reports skip vectorization and
+classification.
+"""
+import os
+import re
+import hashlib
+import sqlite3
+
+MAX_VARIABLES = 500  # keys per sqlite statement, under sqlite's limit of 999
+
+
+class ResultCache:
+	""" sqlite-backed map of (normalized text, accession number, marker,
+	model version) to the reported, result and method labels. Once more
+	than max_entries labels are stored, the least recently used are evicted.
+	"""
+
+	def __init__(self, path, version, max_entries=1000000):
+		""" Initializes ResultCache instance, creating the sqlite file if needed.
+		Args:
+			path (str) : path to sqlite file
+			version (str) : version of the models and patterns; labels stored
+				under any other version are never returned
+			max_entries (int) : number of labels kept before eviction
+		"""
+		self.version = version
+		self.max_entries = max_entries
+		self.db = sqlite3.connect(path)
+		self.db.text_factory = str
+		with self.db:
+			self.db.execute(
+				'CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, ' +
+				'reported TEXT, result TEXT, method TEXT, used INTEGER)')
+			self.db.execute(
+				'CREATE INDEX IF NOT EXISTS results_used ON results (used)')
+		self.size, last_used = self.db.execute(
+			'SELECT COUNT(*), MAX(used) FROM results').fetchone()
+		self.clock = last_used or 0
+		self.hits = 0
+		self.misses = 0
+
+	def key(self, text, accession, marker):
+		""" Returns the cache key of a report and marker.
+		Args:
+			text (str) : normalized text of pathology report (see get_text)
+			accession (str) : accession number of pathology report
+			marker (str) : gen marker
+		Returns:
+			str : hex digest identifying the report, marker and model version
+		"""
+		digest = hashlib.sha1()
+		for part in self.version, marker, re.sub(r'[\- ]', '', accession), text:
+			digest.update(_bytes(part))
+			digest.update(b'\0')
+		return digest.hexdigest()
+
+	def get_many(self, keys):
+		""" Returns the stored labels of every key found, marking them used.
+		Args:
+			keys (list of str) : cache keys
+		Returns:
+			dict (str:(str, str, str)) : key mapped to reported, result, method
+		"""
+		found = {}
+		keys = list(set(keys))
+		for start in range(0, len(keys), MAX_VARIABLES):
+			chunk = keys[start:start + MAX_VARIABLES]
+			found.update(
+				(key, (reported, result, method))
+				for key, reported, result, method in self.db.execute(
+					'SELECT key, reported, result, method FROM results ' +
+					'WHERE key IN ({})'.format(','.join('?' * len(chunk))), chunk))
+		if found:
+			self.clock += 1
+			with self.db:
+				self.db.executemany(
+					'UPDATE results SET used = ? WHERE key = ?',
+					((self.clock, key) for key in found))
+		self.hits += len(found)
+		self.misses += len(keys) - len(found)
+		return found
+
+	def put_many(self, labels):
+		""" Stores labels, evicting the least recently used if over capacity.
+		Args:
+			labels (dict str:(str, str, str)) :
+				key mapped to reported, result, method
+		"""
+		if not labels:
+			return
+		self.clock += 1
+		with self.db:
+			self.db.executemany(
+				'INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)',
+				((key,) + tuple(value) + (self.clock,)
+					for key, value in labels.items()))
+		self.size += len(labels)
+		if self.size > self.max_entries:
+			self.evict()
+
+	def evict(self):
+		""" Removes the least recently used labels down to 90% of capacity. """
+		self.size = self.db.execute('SELECT COUNT(*) FROM results').fetchone()[0]
+		excess = self.size - int(self.max_entries * 0.9)
+		if excess <= 0:
+			return
+		with self.db:
+			self.db.execute(
+				'DELETE FROM results WHERE key IN ' +
+				'(SELECT key FROM results ORDER BY used LIMIT ?)', (excess,))
+		self.size -= excess
+
+	def close(self):
+		""" Closes the sqlite file. """
+		self.db.close()
+
+
+def model_version(*dirs):
+	""" Returns a digest of every file under the given directories, so
+	cached labels are dropped whenever a model or pattern file changes.
+	Args:
+		dirs (str) : paths to model and pattern directories
+	Returns:
+		str : hex digest of file names and contents
+	"""
+	digest = hashlib.sha1()
+	for directory in dirs:
+		for root, subdirs, files in sorted(os.walk(directory)):
+			for name in sorted(files):
+				path = os.path.join(root, name)
+				digest.update(_bytes(os.path.relpath(path, directory)))
+				with open(path, 'rb') as f:
+					for block in iter(lambda: f.read(1 << 20), b''):
+						digest.update(block)
+	return digest.hexdigest()
+
+
+def _bytes(text):
+	""" Returns text as bytes for hashing. """
+	if isinstance(text, bytes):
+		return text
+	return text.encode('utf-8')
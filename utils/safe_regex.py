@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+
+"""
+author@kathrynegan
+
+Copyright (c) 2015-2017 Fred Hutchinson Cancer Research Center
+
+Licensed under the Apache License, Version 2.0: http://www.apache.org/licenses/LICENSE-2.0
+
+safe_regex.py bounds the time the vectorizer's regexes can take on a single
+report. A pattern with an unbounded repeat such as [\\w ]+ can take time
+quadratic in the length of a line; on long, newline-poor reports one such
+search may run for seconds. GuardedPattern skips these patterns when a
+literal they require is missing, runs a capped rewrite on long lines and
+skips them once a document's time budget is spent.
+"""
+import re
+import time
+import threading
+import sre_parse
+
+MAX_LINE = 2000  # longest line a risky pattern runs on unchanged
+MAX_REPEAT = 200  # cap on unbounded repeats when a line is longer
+BUDGET = 2.0  # seconds per document before risky patterns are skipped
+
+
+def analyze(pattern):
+	""" Describes the cost and shape of a compiled pattern.
+	Args:
+		pattern (regex) : compiled pattern
+	Returns:
+		risky (bool) : True if the pattern has an unbounded repeat
+		literals (list of str) : strings every match must contain
+		line_width (int) : longest match if every match is exactly one whole
+			line (anchored by ^ and $ in multiline mode), None otherwise
+	"""
+	parsed = sre_parse.parse(pattern.pattern, pattern.flags)
+	risky = _unbounded(parsed)
+	literals = [literal for literal in _literals(parsed) if literal]
+	line_width = None
+	items = list(parsed)
+	if (pattern.flags & re.MULTILINE and not pattern.flags & re.DOTALL and
+			len(items) > 2 and
+			_op(items[0]) == 'at' and 'beginning' in str(items[0][1]).lower() and
+			_op(items[-1]) == 'at' and 'end' in str(items[-1][1]).lower() and
+			not any(_newline(item) for item in items[1:-1])):
+		low, high = parsed.getwidth()
+		if high < sre_parse.MAXREPEAT:
+			line_width = high
+	return risky, literals, line_width
+
+
+def longest_line(text):
+	""" Returns the length of the longest line of text. """
+	return len(max(text.split('\n'), key=len))
+
+
+def cap_repeats(pattern, cap):
+	""" Returns pattern with every unbounded repeat (*, + and {m,}) capped at
+	cap repetitions. Escapes and character classes are left untouched.
+	Args:
+		pattern (str) : regex pattern
+		cap (int) : largest number of repetitions
+	Returns:
+		str : pattern matching the same text wherever no repeat runs longer
+	"""
+	converted = []
+	index = 0
+	in_class = False
+	while index < len(pattern):
+		char = pattern[index]
+		if char == '\\':
+			converted.append(pattern[index:index + 2])
+			index += 2
+			continue
+		if in_class:
+			in_class = char != ']'
+		elif char == '[':
+			in_class = True
+			# a leading ']' (after an optional '^') is a literal, not the end
+			end = index + 1
+			if pattern[end:end + 1] == '^':
+				end += 1
+			if pattern[end:end + 1] == ']':
+				end += 1
+			converted.append(pattern[index:end])
+			index = end
+			continue
+		elif char == '*' and pattern[index - 1:index] != '(':
+			char = '{{0,{}}}'.format(cap)
+		elif char == '+' and pattern[index - 1:index] not in ('(', '*', '+', '?', '}'):
+			char = '{{1,{}}}'.format(cap)
+		elif char == '{':
+			match = re.match(r'\{(\d+),\}', pattern[index:])
+			if match:
+				converted.append('{{{},{}}}'.format(match.group(1), max(
+					cap, int(match.group(1)))))
+				index += match.end()
+				continue
+		converted.append(char)
+		index += 1
+	return ''.join(converted)
+
+
+class Budget:
+	""" Per-document time budget shared by the guarded patterns of one set
+	of pattern tables, with counts of how often patterns fell back. Each
+	thread keeps the deadline of the document it is working on. """
+
+	def __init__(self, seconds=BUDGET):
+		""" Initializes Budget instance.
+		Args:
+			seconds (float) : time allowed per document, or None for no limit
+		"""
+		self.seconds = seconds
+		self.local = threading.local()
+		self.lock = threading.Lock()
+		self.capped = 0
+		self.skipped = 0
+
+	def start(self):
+		""" Starts the budget of a new document on this thread. """
+		if self.seconds is not None:
+			self.local.deadline = time.time() + self.seconds
+
+	def expired(self):
+		""" Returns whether this thread's document has used its budget. """
+		deadline = getattr(self.local, 'deadline', None)
+		return deadline is not None and time.time() > deadline
+
+	def count(self, name):
+		""" Adds one to the capped or skipped count. """
+		with self.lock:
+			setattr(self, name, getattr(self, name) + 1)
+
+
+class GuardedPattern:
+	""" Compiled regex stand-in for a risky pattern. Behaves as the pattern
+	unless the text lacks a literal every match needs (no match is possible),
+	has a line longer than max_line (the capped rewrite runs instead), or
+	the document's budget has expired (the pattern is skipped). """
+
+	def __init__(self, pattern, literals, budget, max_line=MAX_LINE, cap=MAX_REPEAT):
+		""" Initializes GuardedPattern instance.
+		Args:
+			pattern (regex) : compiled risky pattern
+			literals (list of str) : strings every match must contain
+			budget (Budget) : time budget of the current document
+			max_line (int) : longest line the pattern runs on unchanged
+			cap (int) : cap on unbounded repeats of the fallback pattern
+		"""
+		self.compiled = pattern
+		self.capped = re.compile(cap_repeats(pattern.pattern, cap), pattern.flags)
+		self.pattern = pattern.pattern
+		self.flags = pattern.flags
+		self.literals = literals
+		self.budget = budget
+		self.max_line = max_line
+
+	def search(self, text):
+		pattern = self._select(text)
+		return pattern.search(text) if pattern is not None else None
+
+	def sub(self, repl, text):
+		return self.subn(repl, text)[0]
+
+	def subn(self, repl, text):
+		pattern = self._select(text)
+		return pattern.subn(repl, text) if pattern is not None else (text, 0)
+
+	def finditer(self, text):
+		pattern = self._select(text)
+		return pattern.finditer(text) if pattern is not None else iter([])
+
+	def _select(self, text):
+		""" Returns the regex to run on text, or None if it cannot match or
+		the budget is spent. """
+		for literal in self.literals:
+			if literal not in text:
+				return None
+		if self.budget.expired():
+			self.budget.count('skipped')
+			return None
+		if longest_line(text) > self.max_line:
+			self.budget.count('capped')
+			return self.capped
+		return self.compiled
+
+
+def _op(item):
+	""" Returns the lowercase name of a parsed regex opcode. """
+	return str(item[0]).lower()
+
+
+def _unbounded(parsed):
+	""" Returns whether parsed regex items contain an unbounded repeat. """
+	for item in parsed:
+		op, value = _op(item), item[1]
+		if op in ('max_repeat', 'min_repeat'):
+			if value[1] >= sre_parse.MAXREPEAT or _unbounded(value[2]):
+				return True
+		elif op == 'subpattern':
+			if _unbounded(value[-1]):
+				return True
+		elif op == 'branch':
+			if any(_unbounded(branch) for branch in value[1]):
+				return True
+	return False
+
+
+def _literals(parsed):
+	""" Returns the runs of literal characters that parsed regex items must
+	match, looking into groups and mandatory repeats but not alternations. """
+	runs = ['']
+	for item in parsed:
+		op, value = _op(item), item[1]
+		char = None
+		if op == 'literal':
+			char = value
+		elif op == 'in' and len(value) == 1 and _op(value[0]) == 'literal':
+			char = value[0][1]
+		if char is not None:
+			runs[-1] += chr(char)
+			continue
+		runs.append('')
+		if op == 'subpattern':
+			runs.extend(_literals(value[-1]))
+		elif op in ('max_repeat', 'min_repeat') and value[0] > 0:
+			runs.extend(_literals(value[2]))
+	return runs
+
+
+def _newline(item):
+	""" Returns whether a parsed regex item could match a newline. """
+	op, value = _op(item), item[1]
+	if op == 'literal':
+		return value == 10
+	if op in ('not_literal', 'any'):
+		return op == 'not_literal' and value != 10
+	if op == 'in':
+		negate = False
+		hits = False
+		for member in value:
+			kind, data = _op(member), member[1]
+			if kind == 'negate':
+				negate = True
+			elif kind == 'literal':
+				hits = hits or data == 10
+			elif kind == 'range':
+				hits = hits or data[0] <= 10 <= data[1]
+			elif kind == 'category':
+				name = str(data).lower()
+				hits = hits or ('space' in name) != ('not_' in name)
+		return hits != negate
+	if op == 'category':
+		name = str(value).lower()
+		return ('space' in name) != ('not_' in name)
+	if op in ('max_repeat', 'min_repeat'):
+		return any(_newline(member) for member in value[2])
+	if op == 'subpattern':
+		return any(_newline(member) for member in value[-1])
+	if op == 'branch':
+		return any(_newline(member) for branch in value[1] for member in branch)
+	return op not in ('at',)
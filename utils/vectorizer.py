@@ -14,21 +14,106 @@ make_vectors.py
 """
 import re
 import os
+import sys
+import itertools
 import json
+import string
+import threading
+from utils.pattern_tree import PatternTree, non_capturing
+from utils.safe_regex import BUDGET, Budget, GuardedPattern, analyze
 
+FUSE_MIN = 20  # accession numbers in a report before one fused pass pays off
+WINDOW_MARGIN = 10  # lines beyond test instances first normalized in windowed mode
+WINDOW_GUARD = 20  # tokens next to a cut edge of a window that are not trusted
+# tokens before and after a test instance its n-grams can read (see _ngrams)
+REACH_BEFORE = 13
+REACH_AFTER = 10
 
-class Vectorizer:
-	""" Stores data and behavior for cleaning, processing, and vectorizing a
-	pathology report as part of  EGFR/ALK classification. """
+NON_ASCII = re.compile(r'[^\x00-\x7f]')
+SPACES = re.compile(r' {2,}')
 
-	def __init__(self):
-		""" Initializies Vectorizor instance by compiling regexes. """
+# maps bytes 128-255 to a space, for python 2 byte strings in get_text
+try:
+	ASCII_TABLE = string.maketrans(''.join(map(chr, range(128, 256))), ' ' * 128)
+except AttributeError:  # python 3, where report text is unicode
+	ASCII_TABLE = None
+
+# tokens that end the window of a test instance
+BREAKS = frozenset(['_SECTION_', 'PUNCTUATION', 'SPECIMEN_LABEL', 'OTHER_TEST'])
+
+try:
+	intern
+except NameError:
+	from sys import intern
+
+# stages of make_vectors, in order, timed by Vectorizer.instrument
+STAGES = [
+	'_get_text', '_cytology_report', '_positive_test', '_test_instance',
+	'_standardize', '_other_accession', '_insufficient', '_substitute',
+	'_stop_list', '_ngrams', '_test_mentions']
+
+
+# pattern tables a Vectorizer reads, see PatternTables
+TABLES = [
+	'budget', 'test_patterns', 'other_patterns', 'section_patterns',
+	'positive_patterns', 'mention_patterns', 'instance_pattern',
+	'standardize_trees', 'substitutions', 'cytology_pattern',
+	'insufficient_pattern', 'accession_pattern', 'stop_list']
+
+_tables = {}  # (safe, budget) mapped to shared PatternTables, see load_tables
+_tables_lock = threading.Lock()
+
+
+def load_tables(safe=False, budget=BUDGET):
+	""" Returns the pattern tables of a mode, compiling them on first use.
+	Tables are kept at module level and only read once compiled, so every
+	vectorizer in a process shares one set, and workers forked after the
+	first call inherit it copy-on-write instead of compiling their own.
+	Args:
+		safe (bool) : tables for safe mode (see PatternTables)
+		budget (float) : seconds per document in safe mode
+	Returns:
+		PatternTables : shared compiled patterns
+	"""
+	key = (safe, budget if safe else None)
+	with _tables_lock:
+		if key not in _tables:
+			_tables[key] = PatternTables(safe, budget)
+		return _tables[key]
+
+
+class PatternTables:
+	""" Compiled patterns used to vectorize reports. Nothing is changed once
+	they are built, so one set can be shared by any number of vectorizers
+	and threads (see load_tables). """
+
+	def __init__(self, safe=False, budget=BUDGET):
+		""" Initializes PatternTables instance by compiling regexes.
+		Args:
+			safe (bool) : guard patterns whose run time can grow quadratically
+				with line length (see utils/safe_regex.py) and skip section
+				patterns on lines too long for them to match
+			budget (float) : seconds per document in safe mode before risky
+				patterns are skipped, or None for no limit
+		"""
+		self.safe = safe
+		self.seconds = budget
+		self.budget = Budget(budget) if safe else None
 		self.test_patterns = self._compile_patterns(
 			'condensed_patterns.json', True, r'[\W\^]', r'[\W$]')
 		self.other_patterns = self._compile_patterns(
 			'other_kw_patterns.json', False, r'[\W\^]', r'[\W$]')
 		self.section_patterns = self._compile_patterns(
 			'section_patterns.json', True, r'^', r'$')
+		self.positive_patterns = self._compile_positive_patterns()
+		self.mention_patterns = self._compile_mention_patterns()
+		self.instance_pattern = re.compile(r'TEST_INSTANCE', flags=re.IGNORECASE)
+		self.standardize_trees = (
+			self._build_trees([(pattern, ' OTHER_TEST ') for pattern, _ in self.test_patterns]) +
+			self._build_trees([
+				(pattern, ' {} '.format(subin)) for pattern, subin in self.section_patterns]) +
+			self._build_trees([
+				(pattern, ' {} '.format(subin)) for pattern, subin in self.other_patterns]))
 		self.substitutions = self._compile_substitutions()
 		self.cytology_pattern = re.compile(
 			r'(cytoprep)|(cytolog)', flags=re.IGNORECASE)
@@ -67,13 +152,96 @@ class Vectorizer:
 				# make sure match pattern is isolated from alphanumeric characters
 				subout1 = r'{}({}){}'.format(pre, pattern, post)
 				subout1 = re.compile(subout1, re.MULTILINE)
-				compiled.append((subout1, subin))
+				compiled.append((self._guard(subout1), subin))
 				if uppercase:
 					subout2 = r'{}({}){}'.format(pre, pattern.upper(), post)
 					subout2 = re.compile(subout2, re.MULTILINE)
-					compiled.append((subout2, subin))
+					compiled.append((self._guard(subout2), subin))
 		return compiled
 
+	def _guard(self, pattern):
+		""" Returns pattern, wrapped in a GuardedPattern in safe mode if it
+		has an unbounded repeat.
+		Args:
+			pattern (regex) : compiled pattern
+		Returns:
+			regex or GuardedPattern : pattern to use
+		"""
+		if self.budget is None:
+			return pattern
+		risky, literals, line_width = analyze(pattern)
+		if not risky:
+			return pattern
+		return GuardedPattern(pattern, literals, self.budget)
+
+	def _build_trees(self, substitutions):
+		""" Builds the pattern trees applying substitutions in order. In safe
+		mode, guarded patterns get a tree of their own so no combined regex
+		repeats their search unguarded, and if every pattern only matches
+		whole lines of bounded length, longer lines are skipped.
+		Args:
+			substitutions (list of (regex, str)) :
+				compiled patterns mapped to their replacement, in order
+		Returns:
+			list of PatternTree : trees to apply in order
+		"""
+		if self.budget is None:
+			return [PatternTree(substitutions)]
+		widths = [analyze(pattern)[2] for pattern, subin in substitutions]
+		max_line = max(widths) if widths and None not in widths else None
+		trees = []
+		run = []
+		for pattern, subin in substitutions:
+			if isinstance(pattern, GuardedPattern):
+				if run:
+					trees.append(PatternTree(run, max_line))
+					run = []
+				trees.append(PatternTree([(pattern, subin)]))
+			else:
+				run.append((pattern, subin))
+		if run or not trees:
+			trees.append(PatternTree(run, max_line))
+		return trees
+
+	def _compile_positive_patterns(self):
+		"""
+		Builds one regex per marker matching any of its test patterns followed
+		by a '+'. The '+' gets lost in the non-word cushion around tests, so
+		the cushion is stripped off the end of each pattern and replaced with an
+		optional run of white space and a '+'.
+		Returns:
+			dict (str:regex) : marker mapped to its fused positive pattern
+		"""
+		truncated = {}
+		for pattern, test in self.test_patterns:
+			truncated.setdefault(test, []).append(
+				non_capturing(pattern.pattern[:-5]) + r'[\s]*[\+]')
+		return {
+			test: re.compile('|'.join(patterns))
+			for test, patterns in truncated.items()}
+
+	def _compile_mention_patterns(self):
+		"""
+		Builds one regex per marker matching any of its test patterns, used to
+		prove that a report never mentions the marker. Only the test instance
+		stage writes TEST_INSTANCE into the text, so when no test pattern
+		matches and the text does not already hold TEST_INSTANCE (in any case,
+		since the stop list uppercases the text) the vector is bound to get
+		NO_KEYWORD_IN_TEXT. If a section or keyword replacement could write
+		TEST_INSTANCE itself, no marker can be ruled out and none are built.
+		Returns:
+			dict (str:regex) : marker mapped to its fused test pattern
+		"""
+		for pattern, subin in self.section_patterns + self.other_patterns:
+			if 'TEST_INSTANCE' in subin.upper():
+				return {}
+		fused = {}
+		for pattern, test in self.test_patterns:
+			fused.setdefault(test, []).append(non_capturing(pattern.pattern))
+		return {
+			test: re.compile('|'.join(patterns), re.MULTILINE)
+			for test, patterns in fused.items()}
+
 	def _compile_substitutions(self):
 		"""
 		Map string to replace to replacement string, ordered by hierarchy.
@@ -109,191 +277,484 @@ class Vectorizer:
 			r'[\[\]]'), ' ')
 		return substitutions
 
+
+class Vectorizer:
+	""" Stores data and behavior for cleaning, processing, and vectorizing a
+	pathology report as part of  EGFR/ALK classification. The state of each
+	report lives in a _Document local to the call and the compiled patterns
+	are shared read only, so one instance can be used by several threads. """
+
+	def __init__(self, safe=False, budget=BUDGET, windowed=False, verify=False):
+		""" Initializies Vectorizor instance with the shared compiled regexes.
+		Args:
+			safe (bool) : guard patterns whose run time can grow quadratically
+				with line length (see utils/safe_regex.py) and skip section
+				patterns on lines too long for them to match
+			budget (float) : seconds per document in safe mode before risky
+				patterns are skipped, or None for no limit
+			windowed (bool) : normalize only the lines around test instances
+				when that is enough (see _normalize_window)
+			verify (bool) : in windowed mode, also normalize the whole text and
+				keep its vector wherever the two differ
+		"""
+		self._use(load_tables(safe, budget))
+		self.windowed = windowed or verify
+		self.verify = verify
+		self.windows = WindowCounts()
+
+	def _use(self, tables):
+		""" Points this vectorizer at a set of pattern tables.
+		Args:
+			tables (PatternTables) : compiled patterns
+		"""
+		self.tables = tables
+		for name in TABLES:
+			setattr(self, name, getattr(tables, name))
+
+	def instrument(self, profiler):
+		""" Records the time of every stage, the calls, hits and time of every
+		regex, and the slowest documents of this vectorizer into a profiler.
+		Stages are replaced on this instance only and patterns on a private
+		copy of its tables, so the shared tables and vectorizers that are not
+		instrumented pay nothing. The profiler is not thread-safe, so an
+		instrumented vectorizer should be used by one thread.
+		Args:
+			profiler (Profiler) : collector of timings (see utils/profiler.py)
+		"""
+		self._use(PatternTables(self.tables.safe, self.tables.seconds))
+		for stage in STAGES:
+			setattr(self, stage, profiler.time_stage(stage, getattr(self, stage)))
+		self.make_vectors = profiler.time_document(self.make_vectors)
+		for name in 'test_patterns', 'section_patterns', 'other_patterns':
+			setattr(self, name, [
+				(profiler.wrap(pattern, '{}[{}]'.format(name, index)), subin)
+				for index, (pattern, subin) in enumerate(getattr(self, name))])
+		for name in 'positive_patterns', 'mention_patterns':
+			setattr(self, name, dict(
+				(marker, profiler.wrap(pattern, '{}[{}]'.format(name, marker)))
+				for marker, pattern in getattr(self, name).items()))
+		for index, tree in enumerate(self.standardize_trees):
+			for position, node in enumerate(tree.nodes()):
+				node.pattern = profiler.wrap(
+					node.pattern, 'standardize_trees[{}].node[{}]'.format(index, position))
+		for index, (subout, subin) in self.substitutions.items():
+			self.substitutions[index] = (
+				profiler.wrap(subout, 'substitutions[{}]'.format(index)), subin)
+		for name in 'accession_pattern', 'stop_list', 'instance_pattern':
+			setattr(self, name, profiler.wrap(getattr(self, name), name))
+
 	def make_vector(self, text, accession, marker):
 		""" Initial/main method for vector creation. Requires a file that
 		(at minimum) contains the unique id of the report (instance), the
 		pathology report accession number and the raw text of the pathology
 		report. Assumed to be a tab delimited file.
 		"""
-		self.accession = re.sub(r'[\- ]', '', accession)
-		self.text = self._get_text(text)
-		self.vector = []
-		self.marker = marker
-		self._cytology_report()
-		self._positive_test()
-		self._test_instance()
-		self._standardize()
-		self._other_accession()
-		self._insufficient()
-		self._substitute()
-		self._stop_list()
-		self._ngrams()
-		self._test_mentions()
-		return self.vector
+		return self.make_vectors(text, accession, [marker])[marker]
+
+	def make_vectors(self, text, accession, markers, skip_unmentioned=False):
+		""" Creates vectors for several markers from one pathology report.
+		Only the positive test and test instance stages depend on the marker,
+		so the remaining normalization (standardization, accession numbers,
+		substitutions and stop list) is run once per distinct text produced
+		by those stages. Markers that are not mentioned in the report leave
+		the text unchanged and therefore share a single normalization pass.
+		Args:
+			text (str) : raw text of pathology report
+			accession (str) : accession number of pathology report
+			markers (list of str) : markers to create vectors for
+			skip_unmentioned (bool) : map markers the report provably never
+				mentions to None instead of a vector (see mentions)
+		Returns:
+			dict (str:list of str) : marker mapped to its vector, identical
+				to the vector returned by make_vector for that marker
+		"""
+		if self.budget is not None:
+			self.budget.start()
+		accession = re.sub(r'[\- ]', '', accession)
+		ascii_text = self._get_text(text)
+		normalized = {}  # text after test instance mapped to (final text, features)
+		vectors = {}
+		for marker in markers:
+			if skip_unmentioned and not self.mentions(ascii_text, marker):
+				vectors[marker] = None
+				continue
+			doc = _Document(ascii_text, accession, marker)
+			self._cytology_report(doc)
+			self._positive_test(doc)
+			self._test_instance(doc)
+			instance_text = doc.text
+			if instance_text in normalized:
+				doc.text, features = normalized[instance_text]
+				doc.vector.extend(features)
+			else:
+				start = len(doc.vector)
+				if not (self.windowed and self._normalize_window(doc)):
+					self._normalize(doc)
+				normalized[instance_text] = (doc.text, doc.vector[start:])
+			self._ngrams(doc)
+			self._test_mentions(doc)
+			vectors[marker] = doc.vector
+		return vectors
+
+	def mentions(self, text, marker):
+		""" Returns False only if the vector of text for marker is certain to
+		get NO_KEYWORD_IN_TEXT, in which case it is always classified as
+		not reported. Runs one regex search instead of the full pipeline.
+		Args:
+			text (str) : ascii-only text of pathology report (see get_text)
+			marker (str) : gen marker
+		Returns:
+			bool : False if the report cannot mention marker, True otherwise
+		"""
+		pattern = self.mention_patterns.get(marker)
+		if pattern is None or self.instance_pattern.search(text):
+			return True
+		return pattern.search(text) is not None
 
 	def _get_text(self, text):
-		""" Returns ascii-only version of text. Subs non-ascii characters
-		with white space and truncates multiple sequential space characters
-		to one space character.
+		""" Returns ascii-only version of text (see get_text).
 		Args:
 			text (str) : text to remove non-ascii characters from
 		Returns:
 			str : processed text
 		"""
-		ascii_only = []
-		for char in text:
-			if ord(char) >= 128:
-				char = ' '
-			ascii_only.append(char)
-		ascii_only = ''.join(ascii_only)
-		ascii_only = re.sub(r' +', ' ', ascii_only)
-		text = re.sub(r' +', ' ', ascii_only)
-		text = text.replace('<newline>', '\n')
-		return text
-
-	def _cytology_report(self):
+		return get_text(text)
+
+	def _cytology_report(self, doc):
 		""" Adds cytology report feature to vector. All reports receive this
 		feature even if they are not cytology related due to quirk in original
 		classifier code (see commented line for deprecated version). """
-		# result = 1 if self.cytology_pattern.search(self.text) else 0
-		self.vector.append('CYTO_RELATED_REPORT')
+		# result = 1 if self.cytology_pattern.search(doc.text) else 0
+		doc.vector.append('CYTO_RELATED_REPORT')
 
-	def _positive_test(self):
+	def _positive_test(self, doc):
 		""" Adds existence of one or more positive genetic tests to vector. """
-		for pattern, test in self.test_patterns:
-			if test != self.marker:
-				continue
-			# the '+' get lost in the [\W] buffer around tests - pull them out
-			# not pulling out '-', since it's ambiguous; minus or just a dash?
-			# strips off the "cushion" from the end of the test instance pattern
-			trunc_pattern = re.compile(pattern.pattern[:-5] + r'[\s]*[\+]')
-			if trunc_pattern.search(self.text):
-				self.vector.append('post_window=POSITIVE')
-				self.vector.append('post_window=TEST_INSTANCE_POSITIVE')
-				break
+		# not pulling out '-', since it's ambiguous; minus or just a dash?
+		pattern = self.positive_patterns.get(doc.marker)
+		if pattern and pattern.search(doc.text):
+			doc.vector.append('post_window=POSITIVE')
+			doc.vector.append('post_window=TEST_INSTANCE_POSITIVE')
 
-	def _test_instance(self):
+	def _test_instance(self, doc):
 		""" Replaces instances of a genetic test with generic placeholder. """
 		for pattern, test in self.test_patterns:
-			if test != self.marker:
+			if test != doc.marker:
 				continue
-			self.text = pattern.sub(' TEST_INSTANCE ', self.text)
+			doc.text = pattern.sub(' TEST_INSTANCE ', doc.text)
+
+	def _normalize(self, doc):
+		""" Runs the stages from standardization through the stop list. """
+		self._standardize(doc)
+		self._other_accession(doc)
+		self._insufficient(doc)
+		self._substitute(doc)
+		self._stop_list(doc)
+
+	def _normalize_window(self, doc):
+		""" Normalizes only the lines around the test instances of doc, the
+		only part of the text the remaining features are taken from: the
+		n-gram windows of each test instance and the nearest section header
+		before the first one. The region starts WINDOW_MARGIN lines beyond
+		the test instances and doubles until, in its normalized tokens, the
+		windows and a section header lie at least WINDOW_GUARD tokens from
+		each edge the region was cut at, so text beyond the cut cannot change
+		them. Accession numbers found outside the region are still replaced
+		in it, in report order. Gives up, leaving doc untouched, once the
+		region would cover half the text, or if a test instance is so close
+		to the start that its window wraps around to the end of the text.
+		Args:
+			doc (_Document) : report after the test instance stage
+		Returns:
+			bool : True if doc was normalized, False if the whole text must be
+				normalized instead
+		"""
+		if not self.mention_patterns:
+			return False  # a replacement could write TEST_INSTANCE anywhere
+		lines = doc.text.split('\n')
+		mentioned = [
+			index for index, line in enumerate(lines)
+			if self.instance_pattern.search(line)]
+		if not mentioned:
+			# the vector gets no n-grams, so no text is needed
+			region = _Document('', doc.accession, doc.marker)
+			self._normalize(region)
+			self._adopt(doc, region)
+			self.windows.count('windowed')
+			return True
+		margin = WINDOW_MARGIN
+		while True:
+			begin = max(mentioned[0] - margin, 0)
+			end = min(mentioned[-1] + margin + 1, len(lines))
+			# cut edges keep their newline so patterns anchored on it still match
+			before = '\n'.join(lines[:begin]) + '\n' if begin > 0 else ''
+			after = '\n' + '\n'.join(lines[end:]) if end < len(lines) else ''
+			text = '\n'.join(lines[begin:end])
+			if len(text) * 2 > len(doc.text):
+				self.windows.count('full')
+				return False
+			region = _Document(
+				before[-1:] + text + after[:1], doc.accession, doc.marker)
+			self._standardize(region)
+			self._other_accession(region, before, after)
+			self._insufficient(region)
+			self._substitute(region)
+			self._stop_list(region)
+			tokens = region.text.split()
+			instances = [
+				index for index, token in enumerate(tokens) if token == 'TEST_INSTANCE']
+			if not instances or (begin == 0 and instances[0] < REACH_BEFORE):
+				self.windows.count('full')
+				return False
+			sections = [
+				index for index in range(WINDOW_GUARD, instances[0])
+				if tokens[index] == '_SECTION_']
+			start_safe = begin == 0 or (
+				sections and instances[0] - REACH_BEFORE >= WINDOW_GUARD)
+			end_safe = end == len(lines) or (
+				len(tokens) - instances[-1] - REACH_AFTER >= WINDOW_GUARD)
+			if start_safe and end_safe:
+				break
+			margin *= 2
+		self.windows.count('windowed')
+		if self.verify:
+			full = _Document(doc.text, doc.accession, doc.marker)
+			self._normalize(full)
+			if self._tail(region) != self._tail(full):
+				self.windows.count('mismatched')
+				sys.stderr.write(
+					'Windowed vector differs from full vector for {} ({}); '.format(
+						doc.accession, doc.marker) + 'keeping the full vector\n')
+				region = full
+		self._adopt(doc, region)
+		return True
+
+	def _adopt(self, doc, normalized):
+		""" Takes over the text and features of a normalized copy of doc. """
+		doc.text = normalized.text
+		doc.vector.extend(normalized.vector)
+
+	def _tail(self, doc):
+		""" Returns the features the n-gram and test mention stages would
+		add to a normalized doc, without changing it. """
+		copy = _Document(doc.text, doc.accession, doc.marker)
+		self._ngrams(copy)
+		self._test_mentions(copy)
+		return doc.vector + copy.vector
 
-	def _standardize(self):
+	def _standardize(self, doc):
 		""" Standardizes patterns in report. """
 		# kinda gross hack - this runs through twice to catch overlapping patterns
 		# (because of [\W] buffer in pattern match)
 		for i in range(2):
-			# replace all other tests in the text
-			for subout, subin in self.test_patterns:
-				self.text = subout.sub(' OTHER_TEST ', self.text)
-			for subout, subin in self.section_patterns:
-				self.text = subout.sub(' {} '.format(subin), self.text)
-			for subout, subin in self.other_patterns:
-				self.text = subout.sub(' {} '.format(subin), self.text)
-
-	def _other_accession(self):
+			# replace all other tests, then sections, then other keywords;
+			# each tree skips patterns that cannot match the current text
+			for tree in self.standardize_trees:
+				doc.text = tree.sub(doc.text)
+
+	def _other_accession(self, doc, before='', after=''):
 		""" Adds whether other/previous pathology reports are mentioned to vector,
-		subs accession numbers out of report text. """
-		# find all accession numbers
-		for match in self.accession_pattern.finditer(self.text):
-			accession = re.sub(r'[()\- ]', '', match.group(1))
+		subs accession numbers out of report text.
+		Args:
+			doc (_Document) : report
+			before (str) : text preceding doc in the report, if doc is a window
+			after (str) : text following doc in the report, if doc is a window
+		"""
+		# find all accession numbers; each one found is replaced wherever it
+		# occurs, in the order found, as one re.sub per match used to do
+		replacements = []
+		found = set()
+		matches = itertools.chain(*[
+			self.accession_pattern.finditer(text) for text in (before, doc.text, after)])
+		for match in matches:
+			subout = match.group(1)
+			if subout in found:
+				continue
+			found.add(subout)
+			accession = re.sub(r'[()\- ]', '', subout)
 			# string to sub if accession number matches the one for this report
-			if accession == self.accession:
+			if accession == doc.accession:
 				subin = ' THIS_ACC_NUM '
 			else:
 				subin = ' OTHER_ACC_NUM '
-			# escape parentheses
-			subout = match.group(1)
-			subout = re.sub(r'\(', '\\(', subout)
-			subout = re.sub(r'\)', '\\)', subout)
-			self.text = re.sub(subout, subin, self.text)
-		self.vector.append('OTHER_ACC_NUM_IN_TEXT')
+			replacements.append((subout, subin))
+		if replacements:
+			doc.text = replace_literals(doc.text, replacements)
+		doc.vector.append('OTHER_ACC_NUM_IN_TEXT')
 
-	def _insufficient(self):
+	def _insufficient(self, doc):
 		""" Adds insufficient feature to vector. All reports receive this
 		feature even if they are sufficient due to quirk in original
 		classifier code (see commented line for deprecated version). """
-		# result = 1 if self.insufficient_pattern.search(self.text) else 0
-		self.vector.append('INSUFFICIENT')
+		# result = 1 if self.insufficient_pattern.search(doc.text) else 0
+		doc.vector.append('INSUFFICIENT')
 
-	def _substitute(self):
+	def _substitute(self, doc):
 		""" Makes iterative substitutions in text. """
 		for index in sorted(self.substitutions):
 			subout, subin = self.substitutions[index]
-			self.text = subout.sub(subin, self.text)
+			doc.text = subout.sub(subin, doc.text)
 
-	def _stop_list(self):
+	def _stop_list(self, doc):
 		""" Removes stop list items from report. Run twice to catch
 		downstream patterns. """
-		self.text = self.text.upper()
-		self.text = re.sub(self.stop_list, ' ', self.text)
-		self.text = re.sub(self.stop_list, ' ', self.text)
+		doc.text = doc.text.upper()
+		doc.text = self.stop_list.sub(' ', doc.text)
+		doc.text = self.stop_list.sub(' ', doc.text)
 
-	def _ngrams(self):
-		""" Adds ngrams to vector. """
-		tokens = self.text.strip().split()
+	def _ngrams(self, doc):
+		""" Adds ngrams to vector. Break tokens and the nearest preceding
+		section are tracked in one pass over the tokens, so each test
+		instance only costs the size of its window. """
+		tokens = doc.text.strip().split()
+		is_break = [token in BREAKS for token in tokens]
+		vector = doc.vector
+		section = None  # index of the last _SECTION_ token seen
 		for index, token in enumerate(tokens):
+			if token == '_SECTION_':
+				section = index
 			if token != 'TEST_INSTANCE':
 				continue
-			self.vector.append(self.marker)
-			self._add_section(tokens, index)
-			start, end = self._get_window(tokens, index)
+			vector.append(doc.marker)
+			if section is not None:
+				# name of section is the token after _SECTION_, if any before index
+				vector.append(intern(
+					'SECTION=' + (tokens[section + 1] if section + 1 < index else '')))
+			start, end = self._get_window(is_break, index)
 			if index > 0 and index > start:
-				self.vector.append('immediately_pre_window=' + tokens[index - 1])
+				vector.append(intern('immediately_pre_window=' + tokens[index - 1]))
 			for i in reversed(range(start, index)):
-				self.vector.append('pre_window=' + tokens[i])
+				vector.append(intern('pre_window=' + tokens[i]))
 				for j in 1, 2, 3:
-					# if statement contains index per original
+					# if statement contains index per original; i - j may wrap
+					# around to the end of tokens, also per original
 					if index - j > start:
-						self.vector.append('pre_window={}_{}'.format(tokens[i - j], tokens[i]))
+						vector.append(intern(
+							'pre_window=' + tokens[i - j] + '_' + tokens[i]))
 			if index < len(tokens) - 1 and index < end - 1:
-				self.vector.append('immediately_post_window=' + tokens[index + 1])
+				vector.append(intern('immediately_post_window=' + tokens[index + 1]))
 			for i in range(index + 1, min(len(tokens), end)):
-				self.vector.append('post_window=' + tokens[i])
+				vector.append(intern('post_window=' + tokens[i]))
 				for j in 1, 2, 3:
 					if i < end - j:
-						self.vector.append('post_window={}_{}'.format(tokens[i], tokens[i + j]))
+						vector.append(intern(
+							'post_window=' + tokens[i] + '_' + tokens[i + j]))
 
-	def _get_window(self, tokens, index):
+	def _get_window(self, is_break, index):
 		""" Returns start and end indexes for window around given index.
 		Args:
-			tokens (list of str) : tokenized pathology report
+			is_break (list of bool) : whether each token breaks windows
 			index (int) : current index
 		Returns:
 			start (int) : start index for this window
 			end (int) : end index for this window
 		"""
 		window_start = max(index - 10, 0)
-		window_end = min(len(tokens), index + 10)
-		window = tokens[window_start:window_end]
+		window_end = min(len(is_break), index + 10)
+		size = window_end - window_start
+		half = size // 2  # integer division, as in the original python 2 code
 		# break window size for new sections or other tests, etc
-		breaks = [
-			i for i, t in enumerate(window)
-			if t in ('_SECTION_', 'PUNCTUATION', 'SPECIMEN_LABEL', 'OTHER_TEST')]
+		breaks = [i for i in range(size) if is_break[window_start + i]]
 		breaks.append(0)
-		start = window_start + max([i + 1 for i in breaks if i < len(window) / 2])
-		breaks[-1] = len(window)
+		start = window_start + max([i + 1 for i in breaks if i < half])
+		breaks[-1] = size
 		# start is applied to end per original
-		end = window_start + min([i for i in breaks if i > len(window) / 2])
+		end = window_start + min([i for i in breaks if i > half])
 		return start, end
 
-	def _add_section(self, tokens, index):
-		""" Adds section name to vector.
-		Args:
-			tokens (list of str) : tokenized pathology report
-			index (int) : current index
-		"""
-		# look backwards from test instance to find name of section
-		prev = ''
-		for curr in reversed(tokens[:index]):
-			if curr == '_SECTION_':
-				self.vector.append('SECTION=' + prev)
-				break
-			prev = curr
-
-	def _test_mentions(self):
+	def _test_mentions(self, doc):
 		""" Adds test mentions feature to vector. """
-		self.vector.append('COUNT_TEST_INSTANCE')
-		if not self.text.count('TEST_INSTANCE'):
-			self.vector.append('NO_KEYWORD_IN_TEXT')
+		doc.vector.append('COUNT_TEST_INSTANCE')
+		if not doc.text.count('TEST_INSTANCE'):
+			doc.vector.append('NO_KEYWORD_IN_TEXT')
+
+
+class WindowCounts:
+	""" Thread-safe counts of reports normalized by window, reports that
+	needed the whole text, and windowed vectors that failed verification. """
+
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.windowed = 0
+		self.full = 0
+		self.mismatched = 0
+
+	def count(self, name):
+		""" Adds one to the windowed, full or mismatched count. """
+		with self.lock:
+			setattr(self, name, getattr(self, name) + 1)
+
+
+class _Document:
+	""" Tiny class to store the state of one report and marker while its
+	vector is made; every stage reads and updates one of these. """
+
+	def __init__(self, text, accession, marker):
+		self.text = text
+		self.accession = accession
+		self.marker = marker
+		self.vector = []
+
+
+def replace_literals(text, replacements):
+	""" Returns text with every occurrence of each string replaced, exactly
+	as calling str.replace for each in order would. With at least FUSE_MIN
+	strings, none of which can overlap another or a replacement, the
+	occurrences are disjoint and stay so after replacing, so one regex pass
+	over the text gives the same result.
+	Args:
+		text (str) : text to substitute
+		replacements (list of (str, str)) :
+			distinct strings mapped to their replacement, in order
+	Returns:
+		str : substituted text
+	"""
+	if len(replacements) >= FUSE_MIN and not _overlapping(replacements):
+		lookup = dict(replacements)
+		pattern = re.compile('|'.join(re.escape(old) for old, new in replacements))
+		return pattern.sub(lambda match: lookup[match.group()], text)
+	for old, new in replacements:
+		text = text.replace(old, new)
+	return text
+
+
+def _overlapping(replacements):
+	""" Returns whether any string to replace could share characters with an
+	occurrence of another string or of a replacement: one contains the other
+	or a suffix of one is a prefix of the other. A string overlapping itself
+	is also reported, which only costs the fused pass.
+	Args:
+		replacements (list of (str, str)) : strings mapped to replacements
+	Returns:
+		bool : True if a fused pass could differ from sequential replaces
+	"""
+	olds = [old for old, new in replacements]
+	news = list(set(new for old, new in replacements))
+	joined = '\0'.join(olds + news)
+	if any(joined.count(old) > 1 for old in olds):
+		return True
+	old_prefixes = set(old[:i] for old in olds for i in range(1, len(old)))
+	new_prefixes = set(new[:i] for new in news for i in range(1, len(new)))
+	for old in olds:
+		for i in range(1, len(old)):
+			if old[i:] in old_prefixes or old[i:] in new_prefixes:
+				return True
+	return any(
+		new[i:] in old_prefixes for new in news for i in range(1, len(new)))
+
+
+def get_text(text):
+	""" Returns ascii-only version of text. Subs non-ascii characters
+	with white space and truncates multiple sequential space characters
+	to one space character. Byte strings are folded with str.translate
+	and unicode with one regex pass, rather than char by char.
+	Args:
+		text (str) : text to remove non-ascii characters from
+	Returns:
+		str : processed text
+	"""
+	if ASCII_TABLE is not None and isinstance(text, str):
+		text = text.translate(ASCII_TABLE)
+	else:
+		text = NON_ASCII.sub(' ', text)
+	text = SPACES.sub(' ', text)
+	return text.replace('<newline>', '\n')
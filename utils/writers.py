@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+
+"""
+author@kathrynegan
+
+Copyright (c) 2015-2017 Fred Hutchinson Cancer Research Center
+
+Licensed under the Apache License, Version 2.0: http://www.apache.org/licenses/LICENSE-2.0
+
+writers.py holds the output layer for record-level and case-level results.
+Rows are buffered and written in bulk, as tab delimited text, as newline
+delimited JSON objects keyed by header, or into a sqlite table with one
+column per header. Every format keeps the same headers and rows. Writers
+can be synced to disk and later resumed from the position synced, and rows
+that cannot be processed are collected in a quarantine file.
+"""
+import os
+import csv
+import sqlite3
+from json.encoder import encode_basestring_ascii
+
+FORMATS = ('tsv', 'ndjson', 'sqlite')
+BUFFER = 1000  # rows held before they are written
+EXTENSIONS = {'tsv': '.txt', 'ndjson': '.ndjson', 'sqlite': '.sqlite'}
+
+
+def open_writer(output, path, table, headers, buffer=BUFFER, resume=None):
+	""" Returns a writer for a format.
+	Args:
+		output (str) : one of FORMATS
+		path (str) : path to output file
+		table (str) : name of table, used by sqlite only
+		headers (list of str) : names of columns
+		buffer (int) : rows held before they are written
+		resume (int) : position returned by sync of an earlier writer of the
+			same output, to drop anything written after it and append from
+			there, or None to write a new output
+	Returns:
+		TableWriter : writer, open and with headers written
+	"""
+	if output == 'tsv':
+		return TSVWriter(path, headers, buffer, resume)
+	if output == 'ndjson':
+		return NDJSONWriter(path, headers, buffer, resume)
+	if output == 'sqlite':
+		return SqliteWriter(path, table, headers, buffer, resume)
+	raise ValueError('Unknown output format: {}'.format(output))
+
+
+class TableWriter:
+	""" Buffers rows of a table and writes them in bulk. Subclasses write
+	the headers on opening and implement _flush. """
+
+	def __init__(self, headers, buffer=BUFFER):
+		""" Initializes TableWriter instance.
+		Args:
+			headers (list of str) : names of columns
+			buffer (int) : rows held before they are written
+		"""
+		self.headers = headers
+		self.buffer = buffer
+		self.rows = []
+
+	def write(self, row):
+		""" Adds a row, writing held rows once the buffer is full.
+		Args:
+			row (list of str) : one value per header
+		"""
+		self.rows.append(row)
+		if len(self.rows) >= self.buffer:
+			self.flush()
+
+	def flush(self):
+		""" Writes every held row. """
+		if self.rows:
+			self._flush(self.rows)
+			self.rows = []
+
+	def sync(self):
+		""" Writes held rows through to disk.
+		Returns:
+			int : position of the output, to resume from
+		"""
+		raise NotImplementedError
+
+	def close(self):
+		""" Writes held rows and closes the output. """
+		self.flush()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc_info):
+		self.close()
+
+
+class FileWriter(TableWriter):
+	""" Writes rows to a text file, one write per buffer of rows. Positions
+	are byte offsets into the file. """
+
+	def __init__(self, path, headers, buffer=BUFFER, resume=None):
+		TableWriter.__init__(self, headers, buffer)
+		if resume is None:
+			self.file = open(path, 'w')
+			self.file.write(self._start())
+		else:
+			self.file = _reopen(path, resume)
+
+	def _start(self):
+		""" Returns the text the file starts with. """
+		return ''
+
+	def sync(self):
+		self.flush()
+		return _sync(self.file)
+
+	def close(self):
+		TableWriter.close(self)
+		self.file.close()
+
+
+class TSVWriter(FileWriter):
+	""" Writes a tab delimited file with headers. """
+
+	def _start(self):
+		return '\t'.join(self.headers) + '\n'
+
+	def _flush(self, rows):
+		self.file.write(''.join('\t'.join(row) + '\n' for row in rows))
+
+
+class NDJSONWriter(FileWriter):
+	""" Writes one JSON object per row, keyed by header in column order, as
+	json.dumps would. Keys are encoded once and values with the same string
+	encoder json.dumps uses, rather than building a dict per row. """
+
+	def __init__(self, path, headers, buffer=BUFFER, resume=None):
+		FileWriter.__init__(self, path, headers, buffer, resume)
+		self.keys = [encode_basestring_ascii(header) + ': ' for header in headers]
+
+	def _flush(self, rows):
+		keys = self.keys
+		self.file.write(''.join(
+			'{' + ', '.join([
+				key + encode_basestring_ascii(value) for key, value in zip(keys, row)]) +
+			'}\n' for row in rows))
+
+
+class SqliteWriter(TableWriter):
+	""" Writes a sqlite table with one text column per header, replacing any
+	table of the same name. Each buffer of rows is inserted with one
+	executemany in its own transaction. Positions are numbers of rows. """
+
+	def __init__(self, path, table, headers, buffer=BUFFER, resume=None):
+		TableWriter.__init__(self, headers, buffer)
+		self.db = sqlite3.connect(path)
+		self.db.text_factory = str
+		columns = ', '.join(_quote(header) + ' TEXT' for header in headers)
+		with self.db:
+			if resume is None:
+				self.db.execute('DROP TABLE IF EXISTS {}'.format(_quote(table)))
+				self.db.execute('CREATE TABLE {} ({})'.format(_quote(table), columns))
+			else:
+				# rows are only ever appended, so rowids run from 1 in order
+				self.db.execute(
+					'DELETE FROM {} WHERE rowid > ?'.format(_quote(table)), (resume,))
+		self.insert = 'INSERT INTO {} VALUES ({})'.format(
+			_quote(table), ', '.join('?' * len(headers)))
+		self.count = resume or 0
+
+	def _flush(self, rows):
+		with self.db:
+			self.db.executemany(self.insert, rows)
+		self.count += len(rows)
+
+	def sync(self):
+		self.flush()
+		return self.count
+
+	def close(self):
+		TableWriter.close(self)
+		self.db.close()
+
+
+class Quarantine:
+	""" Tab delimited file collecting rows that cannot be processed, each led
+	by its line number in the input, so they can be fixed and rerun. """
+
+	def __init__(self, path, resume=None, count=0):
+		""" Initializes Quarantine instance.
+		Args:
+			path (str) : path to quarantine file
+			resume (int) : position returned by sync of an earlier quarantine
+				of the same file to append from, or None to start a new file
+			count (int) : rows written before position
+		"""
+		self.path = path
+		self.file = open(path, 'w') if resume is None else _reopen(path, resume)
+		self.writer = csv.writer(self.file, delimiter='\t', lineterminator='\n')
+		self.count = count
+
+	def add(self, line_num, row):
+		""" Writes a row and the input line number it ended on. """
+		self.writer.writerow([line_num] + row)
+		self.count += 1
+
+	def sync(self):
+		""" Writes rows through to disk and returns the position of the file. """
+		return _sync(self.file)
+
+	def close(self):
+		self.file.close()
+
+
+def _reopen(path, position):
+	""" Opens a file for writing at position, dropping anything after it. """
+	fout = open(path, 'r+')
+	fout.truncate(position)
+	fout.seek(position)
+	return fout
+
+
+def _sync(fout):
+	""" Writes a file through to disk and returns its position. """
+	fout.flush()
+	os.fsync(fout.fileno())
+	return fout.tell()
+
+
+def _quote(name):
+	""" Returns name quoted as a sqlite identifier. """
+	return '"{}"'.format(name.replace('"', '""'))